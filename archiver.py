@@ -0,0 +1,215 @@
+"""
+Packs beatmap folders into .osz archives in Cleanup and unpacks them again, see Engine.archive.
+
+An .osz is a zip of the files of a beatmap folder, osu! imports one that gets dropped on its window.
+Every folder is one job for a pool of worker processes, so compression runs on all cores. Audio, video
+and images are already compressed and only get stored, everything else (.osu, .osb, text) gets deflated.
+
+A folder is only removed once its archive was read back: the entries have to match the files of the
+folder by name and size and every CRC has to check out. Archives are written to a .osz.partial file
+and renamed once verified, so an .osz in Cleanup is always complete. Unpacking goes the other way
+round, into a .osz.partial folder in Cleanup that gets renamed into Songs, then the .osz is removed.
+"""
+import multiprocessing
+import multiprocessing.connection
+import os
+import shutil
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+
+import tracing
+from cancel import Cancelled, bounded_jobs
+from mover import MoveReport
+
+ARCHIVE_EXTENSION = ".osz"
+PARTIAL_SUFFIX = ".osz.partial"  # archives being written and folders being unpacked, in Cleanup
+ARCHIVE_PROCESSES = os.cpu_count() or 1
+COMPRESS_LEVEL = 6
+STORED_EXTENSIONS = (".mp3", ".ogg", ".m4a", ".aac", ".flac", ".opus",
+                     ".mp4", ".m4v", ".avi", ".flv", ".mkv", ".webm", ".wmv", ".mov",
+                     ".jpg", ".jpeg", ".png", ".gif", ".webp",
+                     ".osz", ".osk", ".zip")
+
+_stopped = None
+
+
+def _exit_with_parent(parent):
+    multiprocessing.connection.wait([parent.sentinel])
+    os._exit(1)  # a worker would wait for jobs forever once osu!cleaner got killed, the .partial gets removed later
+
+
+def _init_worker(stopped, trace_events=None):
+    global _stopped
+    _stopped = stopped
+    threading.Thread(target=_exit_with_parent, args=(multiprocessing.parent_process(),), daemon=True).start()
+    if trace_events is not None:
+        tracing.forward_to(trace_events, f"osu!cleaner archiver {os.getpid()}")
+
+
+def _check():
+    if _stopped is not None and _stopped.is_set():
+        raise Cancelled()
+
+
+class ArchiveReport(MoveReport):
+    def __init__(self):
+        super().__init__()
+        self.size = 0  # bytes of the files that got packed or unpacked
+        self.packed = 0  # bytes of their archives
+
+
+def archive_path(cleanup, folder):
+    return os.path.join(cleanup, folder + ARCHIVE_EXTENSION)
+
+
+def folder_name(entry):
+    """Name of the beatmap folder an entry of Cleanup holds, None for unfinished archives and unpacks."""
+    if entry.endswith(PARTIAL_SUFFIX):
+        return None
+    if entry.endswith(ARCHIVE_EXTENSION):
+        return entry[:-len(ARCHIVE_EXTENSION)]
+    return entry
+
+
+def remove_partials(cleanup):
+    """Removes what a killed run left half written in cleanup."""
+    try:
+        entries = os.listdir(cleanup)
+    except OSError:
+        return
+    for entry in entries:
+        if entry.endswith(PARTIAL_SUFFIX):
+            path = os.path.join(cleanup, entry)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def archive_members(path):
+    """(name in the archive, path, size) of every file below path, names use forward slashes like zip does."""
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs.sort()
+        for name in sorted(names):
+            file = os.path.join(root, name)
+            if os.path.isfile(file):
+                files.append((os.path.relpath(file, path).replace(os.sep, "/"), file, os.path.getsize(file)))
+    return files
+
+
+def verify_archive(filename, files):
+    """Raises zipfile.BadZipFile unless the archive holds exactly the given files and all of them read back intact."""
+    with zipfile.ZipFile(filename) as archive:
+        entries = {info.filename: info.file_size for info in archive.infolist()}
+        if entries != {name: size for name, _, size in files}:
+            raise zipfile.BadZipFile(f"{os.path.basename(filename)} doesn't match the folder it was packed from")
+        bad = archive.testzip()
+        if bad is not None:
+            raise zipfile.BadZipFile(f"{bad} in {os.path.basename(filename)} is corrupt")
+
+
+def pack_folder(src, dst):
+    """Packs the folder src into the archive dst, verifies it and removes src. Returns (bytes packed, archive bytes)."""
+    if os.path.lexists(dst):
+        raise FileExistsError(f"{os.path.basename(dst)} already exists")
+    with tracing.span("pack folder", folder=os.path.basename(src)):
+        files = archive_members(src)
+        partial = dst[:-len(ARCHIVE_EXTENSION)] + PARTIAL_SUFFIX
+        os.makedirs(os.path.dirname(dst), exist_ok=True)  # folders in a subfolder of Songs keep it in Cleanup
+        try:
+            with zipfile.ZipFile(partial, "w", allowZip64=True) as archive:
+                for name, path, _ in files:
+                    _check()
+                    if name.lower().endswith(STORED_EXTENSIONS):
+                        archive.write(path, name, zipfile.ZIP_STORED)
+                    else:
+                        archive.write(path, name, zipfile.ZIP_DEFLATED, COMPRESS_LEVEL)
+            _check()
+            with tracing.span("verify archive", folder=os.path.basename(src)):
+                verify_archive(partial, files)
+            os.rename(partial, dst)
+        except BaseException:
+            try:
+                os.remove(partial)
+            except OSError:
+                pass
+            raise
+    # the archive is complete from here on, see Engine.recover for a run that gets killed while removing src
+    shutil.rmtree(src)
+    return sum(size for _, _, size in files), os.path.getsize(dst)
+
+
+def unpack_folder(src, dst):
+    """Unpacks the archive src into the folder dst and removes src. Returns (bytes unpacked, archive bytes)."""
+    if os.path.lexists(dst):
+        raise FileExistsError(f"{os.path.basename(dst)} already exists")
+    with tracing.span("unpack folder", folder=os.path.basename(dst)):
+        partial = src[:-len(ARCHIVE_EXTENSION)] + PARTIAL_SUFFIX
+        size = 0
+        try:
+            with zipfile.ZipFile(src) as archive:
+                for info in archive.infolist():
+                    _check()
+                    archive.extract(info, partial)  # checks the CRC, names can't get out of partial
+                    size += info.file_size
+            os.makedirs(partial, exist_ok=True)  # an archive of an empty folder has no entries
+            shutil.move(partial, dst)  # a rename unless Songs is on another drive
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+    packed = os.path.getsize(src)
+    os.remove(src)
+    return size, packed
+
+
+def run_jobs(function, jobs, on_progress=None, on_done=None, stopped=None, processes=ARCHIVE_PROCESSES):
+    """
+    Runs function(src, dst) for every (src, dst) pair in a pool of worker processes, returns an ArchiveReport.
+
+    Only a few jobs are queued at a time. Once stopped() turns true no further job is started and the
+    running ones give up before their next file, leaving src as it was. on_progress(done, src) and
+    on_done(src, ok) get called from the calling thread, like in mover.move_folders.
+    """
+    report = ArchiveReport()
+    if not jobs:
+        return report
+    context = multiprocessing.get_context("spawn")  # same as the database loaders, see workers.create_pool
+    cancel = context.Event()
+    done = 0
+    processes = max(1, min(processes, len(jobs)))
+
+    def stopping():
+        # also checked between waits, the workers give up on their next file once cancel is set
+        tracing.drain()
+        if stopped is not None and stopped() and not report.stopped:
+            report.stopped = True
+            cancel.set()
+        return report.stopped
+
+    with ProcessPoolExecutor(processes, context, _init_worker, (cancel, tracing.collector(context))) as pool:
+        for (src, dst), future in bounded_jobs(lambda job: pool.submit(function, *job), jobs, 2 * processes,
+                                               stopping, timeout=1 / 15):
+            try:
+                size, packed = future.result()
+            except Cancelled:
+                continue  # src is still there, the journal won't list it
+            except Exception as err:
+                report.failed.append((src, str(err)))
+                ok = False
+            else:
+                report.moved.append((src, dst))
+                report.size += size
+                report.packed += packed
+                ok = True
+            done += 1
+            if on_done is not None:
+                on_done(src, ok)
+            if on_progress is not None:
+                on_progress(done, src)
+    tracing.drain()
+    return report
@@ -0,0 +1,154 @@
+"""
+Measures how long every phase takes to stop after Engine.cancel_token gets cancelled.
+
+Each phase first runs once to completion to get its duration, then again on a thread that gets
+cancelled at --points evenly spread moments of that duration. The latency is the time from
+cancel() until the thread is gone. Phases:
+    analyze-cold  analyze with an empty scan cache, databases read in place
+    analyze-copy  same, but copying the databases to tmp first (what a scan falls back to)
+    plan          measuring the folders filter(--keep) picked, with an empty size cache
+    work          moving them to Cleanup, the folder is reverted again after every run
+    archive       packing them into .osz archives in Cleanup instead, reverted the same way
+    revert        moving them back
+    delete        deleting them from Cleanup, each run gets hard linked copies of the folders to delete
+    where         matching --where when osu!.db has to be parsed again for its fields, empty scan cache
+    match         matching --where against fields the last scan already decoded
+
+Only meant for generated folders (see generate.py), work, archive and revert really move folders around.
+Exits with 1 if any latency is above --bound.
+
+usage: python benchmarks/bench_cancel.py <osu! folder> [--phases ...] [--where ...] [--points 8] [--bound 0.1]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PHASES = ["analyze-cold", "analyze-copy", "plan", "work", "archive", "revert", "delete", "where", "match"]
+MOVES = ("work", "archive", "revert", "delete")  # phases that need the folders filter(--keep) picks
+WHERE = "stars >= 5 and status in (ranked, loved) or drain_time < 90 and not played"
+
+
+def prepare(engine, phase, keep, where, cache_dir):
+    engine.cancel_token.reset()
+    if phase.startswith("analyze") or phase in ("plan", "where"):
+        shutil.rmtree(cache_dir, ignore_errors=True)  # the scan cache also holds the folder sizes
+    if phase == "plan":
+        engine.analyze()
+        engine.filter(keep)
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    elif phase == "revert":
+        engine.work()
+    elif phase == "delete":
+        cleanup = os.path.join(engine.path, "Cleanup")
+        for folder in engine.paths_to_delete:
+            shutil.copytree(os.path.join(engine.path, "Songs", folder), os.path.join(cleanup, folder),
+                            copy_function=os.link)
+    elif phase in ("where", "match"):
+        # where has to decode the fields of the expression itself, match finds them decoded already
+        engine.where(where if phase == "match" else "")
+        engine.analyze()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+
+def run(engine, phase, where):
+    if phase.startswith("analyze"):
+        engine.analyze()
+    elif phase == "plan":
+        engine.plan()
+    elif phase in ("work", "archive"):
+        engine.work()
+    elif phase == "revert":
+        engine.revert()
+    elif phase == "delete":
+        engine.delete_cleanup()
+    else:
+        engine.where(where)
+
+
+def restore(engine, phase):
+    """Puts every folder back into Songs after a work, archive or revert run, empties Cleanup after a delete."""
+    from journal import Journal
+    engine.cancel_token.reset()
+    if phase in ("work", "archive", "revert"):
+        engine.revert()
+    elif phase == "delete":
+        shutil.rmtree(os.path.join(engine.path, "Cleanup"), ignore_errors=True)
+        shutil.rmtree(os.path.join(engine.path, "Cleanup.deleting"), ignore_errors=True)
+        Journal(engine.path).remove()
+    elif phase in ("where", "match"):
+        engine.where("")
+
+
+def cancelled_after(engine, phase, where, delay):
+    """Runs phase on a thread, cancels it after delay seconds and returns how long it took to stop."""
+    thread = threading.Thread(target=run, args=(engine, phase, where), daemon=True)
+    thread.start()
+    thread.join(delay)
+    start = time.perf_counter()
+    engine.cancel_token.cancel()
+    thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help="a generated osu! folder")
+    parser.add_argument("--phases", default=",".join(PHASES))
+    parser.add_argument("--keep", nargs="+", default=["collections", "scores"],
+                        help="filters for plan, work, archive, revert and delete")
+    parser.add_argument("--where", default=WHERE, help="expression for where and match")
+    parser.add_argument("--points", type=int, default=8, help="cancelled runs per phase")
+    parser.add_argument("--bound", type=float, default=0.1, help="seconds a phase may take to stop")
+    args = parser.parse_args()
+    path = os.path.abspath(args.path)
+
+    work_dir = tempfile.mkdtemp(prefix="osu-cleaner-cancel-")
+    cache_dir = os.path.join(work_dir, "cache")
+    os.environ["XDG_CACHE_HOME"] = os.environ["LOCALAPPDATA"] = cache_dir
+    os.chdir(work_dir)  # copies go to ./tmp
+    from core import Engine
+
+    engine = Engine()
+    engine.path = path
+    failed = []
+    print(f"{'phase':<14}{'duration':>10}{'median':>10}{'max':>10}")
+    try:
+        for phase in args.phases.split(","):
+            engine.snapshot = phase != "analyze-copy"
+            engine.archive = phase == "archive"
+            if phase in MOVES:
+                engine.analyze()
+                engine.filter(args.keep)
+            prepare(engine, phase, args.keep, args.where, cache_dir)
+            start = time.perf_counter()
+            run(engine, phase, args.where)
+            duration = time.perf_counter() - start
+            restore(engine, phase)
+            latencies = []
+            for point in range(1, args.points + 1):
+                prepare(engine, phase, args.keep, args.where, cache_dir)
+                latency = cancelled_after(engine, phase, args.where, duration * point / (args.points + 1))
+                restore(engine, phase)
+                latencies.append(latency)
+            print(f"{phase:<14}{duration * 1000:>8.0f}ms{statistics.median(latencies) * 1000:>8.1f}ms"
+                  f"{max(latencies) * 1000:>8.1f}ms")
+            if max(latencies) > args.bound:
+                failed.append(phase)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if failed:
+        print(f"took longer than {args.bound * 1000:.0f} ms to stop: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
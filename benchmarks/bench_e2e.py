@@ -0,0 +1,207 @@
+"""
+End-to-end benchmark of every phase on synthetic osu! folders, see generate.py.
+
+Each phase runs in a fresh interpreter, so peak RSS is per phase (worker processes included):
+    analyze-cold  analyze with an empty scan cache
+    analyze-warm  analyze again, everything comes from the scan cache
+    filter        filter(--keep) after a warm analyze
+    work          moving everything filter picked to Cleanup
+    revert        moving it all back
+
+I/O bytes come from /proc/self/io, which also counts reaped worker processes. rchar/wchar are bytes
+passed through read()/write() calls, read_bytes/write_bytes what actually hit the disk. Databases
+are memory-mapped, so their reads only show up in read_bytes and only if they weren't cached yet.
+
+The results are printed as JSON. Passing a previous result as --baseline compares wall time and
+peak RSS against it and exits with 1 if any phase got slower or bigger than --tolerance allows.
+
+usage: python benchmarks/bench_e2e.py [--sizes 10000,100000,1000000] [--data-dir DIR]
+                                      [--output FILE] [--baseline FILE] [--tolerance 0.25]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PHASES = ["analyze-cold", "analyze-warm", "filter", "work", "revert"]
+# compared against --baseline, with an absolute slack so sub-millisecond phases don't fail on noise
+COMPARED = {"wall_s": 0.02, "peak_rss_bytes": 4 * 1024 * 1024}
+
+
+def read_io():
+    counters = {}
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                name, value = line.split(":")
+                counters[name] = int(value)
+    except OSError:  # not on Linux
+        pass
+    return counters
+
+
+def child(path, phase, keep):
+    from core import Engine
+
+    engine = Engine()
+    engine.path = path
+    if not phase.startswith("analyze"):
+        if phase != "revert":
+            engine.analyze()
+        if phase == "work":
+            engine.filter(keep)
+
+    io_before = read_io()
+    start = time.perf_counter()
+    if phase.startswith("analyze"):
+        result = engine.analyze()
+        count = len(engine.index)
+    elif phase == "filter":
+        result = engine.filter(keep)
+        count = result[1]
+    elif phase == "work":
+        result = engine.work()
+        count = len(result.moved)
+    else:
+        result = engine.revert()
+        count = len(result.moved)
+    wall = time.perf_counter() - start
+    io_after = read_io()
+
+    # ru_maxrss is in KiB on Linux, the children's value is the largest worker
+    rss = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+              resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+    failed = len(getattr(result, "failed", ()))
+    print(json.dumps({
+        "wall_s": wall,
+        "peak_rss_bytes": rss,
+        **{name: io_after[name] - io_before.get(name, 0) for name in ("rchar", "wchar", "read_bytes", "write_bytes")
+           if name in io_after},
+        "count": count,
+        "failed": failed,
+    }))
+
+
+def dataset(data_dir, beatmaps, osu_files):
+    """Generates the folder for this size once and reuses it on later runs."""
+    from generate import generate
+
+    path = os.path.join(data_dir, f"osu-{beatmaps}")
+    marker = os.path.join(path, "generated.json")
+    try:
+        with open(marker) as f:
+            summary = json.load(f)
+        if summary.get("osu_files") == osu_files and not os.path.exists(os.path.join(path, "Cleanup")):
+            return path, summary
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(path, ignore_errors=True)
+    start = time.perf_counter()
+    summary = generate(path, beatmaps, osu_files=osu_files)
+    summary["osu_files"] = osu_files
+    print(f"generated {path} in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+    with open(marker, "w") as f:
+        json.dump(summary, f)
+    return path, summary
+
+
+def run_phase(path, phase, keep, cache_dir, work_dir):
+    env = dict(os.environ, XDG_CACHE_HOME=cache_dir, LOCALAPPDATA=cache_dir)
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", path, phase, *keep],
+                            check=True, capture_output=True, text=True, cwd=work_dir, env=env).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """Returns a line per phase that got worse than the baseline allows."""
+    previous = {(r["beatmaps"], r["phase"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        before = previous.get((result["beatmaps"], result["phase"]))
+        if before is None:
+            continue
+        for name, slack in COMPARED.items():
+            if result[name] > before[name] * (1 + tolerance) + slack:
+                regressions.append(f"{result['phase']} at {result['beatmaps']} beatmaps: {name} "
+                                   f"{before[name]:.4g} -> {result[name]:.4g}")
+    return regressions
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        return child(sys.argv[2], sys.argv[3], sys.argv[4:])
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="comma separated beatmap counts")
+    parser.add_argument("--phases", default=",".join(PHASES))
+    parser.add_argument("--keep", nargs="+", default=["collections", "scores"], help="filters for filter and work")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per phase, the fastest one is reported")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "osu-cleaner-bench"),
+                        help="where the generated folders are kept between runs")
+    parser.add_argument("--no-osu-files", action="store_true", help="generate empty Songs folders")
+    parser.add_argument("--output", help="also write the results to this file")
+    parser.add_argument("--baseline", help="results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative increase over the baseline")
+    args = parser.parse_args()
+    phases = args.phases.split(",")
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    results = []
+    work_dir = tempfile.mkdtemp(prefix="osu-cleaner-bench-")
+    try:
+        for beatmaps in (int(size) for size in args.sizes.split(",")):
+            path, summary = dataset(args.data_dir, beatmaps, not args.no_osu_files)
+            warm_cache = os.path.join(work_dir, f"cache-{beatmaps}")
+            for phase in PHASES:
+                # the cold analyze always runs, it fills the scan cache every later phase starts from
+                if phase not in phases and phase != "analyze-cold":
+                    continue
+                runs = []
+                for repeat in range(args.repeat):
+                    if phase == "analyze-cold":
+                        shutil.rmtree(warm_cache, ignore_errors=True)
+                    elif phase == "revert" and repeat:
+                        run_phase(path, "work", args.keep, warm_cache, work_dir)  # give it something to move back
+                    runs.append(run_phase(path, phase, args.keep, warm_cache, work_dir))
+                    if phase == "work" and repeat < args.repeat - 1:
+                        run_phase(path, "revert", args.keep, warm_cache, work_dir)  # start over from a full Songs
+                if phase not in phases:
+                    continue
+                best = min(runs, key=lambda run: run["wall_s"])
+                results.append({"beatmaps": beatmaps, "phase": phase, **best})
+                print(f"{beatmaps:>9} {phase:<13}{best['wall_s'] * 1000:>10.0f} ms"
+                      f"{best['peak_rss_bytes'] / 1024 / 1024:>9.1f} MiB{best['count']:>9}", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "keep": args.keep,
+        "results": results,
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"regression: {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
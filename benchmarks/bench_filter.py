@@ -0,0 +1,69 @@
+"""
+Shows how building the BeatmapStore and DirectoryIndex and filtering scale with library size.
+Time per hash should stay flat as the number of hashes grows tenfold, sorting the digests makes it creep
+up a little. Exits with 1 if it grows by more than --bound times between two sizes, which is what
+anything quadratic does.
+
+usage: python benchmarks/bench_filter.py [max hashes] [--bound 2]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from index import DirectoryIndex  # noqa: E402
+from store import BeatmapColumns, BeatmapStore  # noqa: E402
+
+
+def run(count):
+    rng = random.Random(count)
+    hashes = [f"{rng.getrandbits(128):032x}" for _ in range(count)]
+    columns = BeatmapColumns()
+    for i, h in enumerate(hashes):
+        columns.append(bytes.fromhex(h), f"{i // 4} artist - title", 0)  # ~4 difficulties per set
+    filters = {
+        "collections": rng.sample(hashes, count // 20),
+        "scores": rng.sample(hashes, count // 10),
+        "played": rng.sample(hashes, count // 3),
+    }
+
+    start = time.perf_counter()
+    index = DirectoryIndex(BeatmapStore.merge([columns]))
+    for name, keep in filters.items():
+        index.add_filter(name, keep)
+    build = time.perf_counter() - start
+
+    start = time.perf_counter()
+    removable = index.removable(list(filters))
+    filtering = time.perf_counter() - start
+    return build, filtering, len(index), len(removable)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("limit", nargs="?", type=int, default=1_000_000, help="most hashes")
+    parser.add_argument("--bound", type=float, default=2.0,
+                        help="times the time per hash may grow from one size to the next, ten times as large")
+    args = parser.parse_args()
+    print(f"{'hashes':>10}{'folders':>10}{'removable':>11}{'index':>11}{'filter':>11}{'ns/hash':>10}")
+    count = 10_000
+    previous = None
+    failed = []
+    while count <= args.limit:
+        build, filtering, folders, removable = run(count)
+        per_hash = (build + filtering) / count * 1e9
+        print(f"{count:>10}{folders:>10}{removable:>11}{build * 1000:>8.1f} ms{filtering * 1000:>8.1f} ms{per_hash:>10.0f}")
+        if previous is not None and per_hash > previous * args.bound:
+            failed.append(f"{count // 10:,} -> {count:,} hashes: {previous:.0f} -> {per_hash:.0f} ns/hash")
+        previous = per_hash
+        count *= 10
+    if failed:
+        print(f"time per hash grew more than {args.bound:g} times:", *failed, sep="\n    ", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
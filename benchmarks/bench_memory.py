@@ -0,0 +1,70 @@
+"""
+Compares how much memory the beatmaps of an osu!.db take in each representation:
+one SmallBeatmapMetadata per beatmap, the hash -> directory dict plus played list osu!cleaner
+used to keep, and the columnar BeatmapStore it keeps now.
+
+usage: python benchmarks/bench_memory.py <osu!.db>
+"""
+import datetime
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from progress import Reporter  # noqa: E402
+from store import BeatmapColumns, BeatmapStore  # noqa: E402
+from utils import SmallOsuDb  # noqa: E402
+
+
+def objects(filename):
+    osu_db = SmallOsuDb(filename, Reporter())
+    osu_db.inFile.close()
+    return osu_db.beatmaps
+
+
+def dicts(filename):
+    hash_table = {}
+    played = []
+    never = datetime.datetime(1, 1, 1)
+    for bm in objects(filename):
+        hash_table[bm.hash] = bm.directory
+        if bm.lastPlayed != never:
+            played.append(bm.hash)
+    return hash_table, played
+
+
+def columns(filename):
+    part = BeatmapColumns()
+    osu_db = SmallOsuDb(filename, Reporter(), columns=part)
+    osu_db.inFile.close()
+    store = BeatmapStore.merge([part])
+    return store, store.played()
+
+
+def measure(build, filename):
+    start = time.perf_counter()
+    tracemalloc.start()
+    result = build(filename)
+    kept, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    elapsed = time.perf_counter() - start
+    return kept, peak, len(pickle.dumps(result, pickle.HIGHEST_PROTOCOL)), elapsed
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__.strip())
+        sys.exit(2)
+    filename = sys.argv[1]
+    mib = 1024 * 1024
+    print(f"{'representation':<16}{'kept':>11}{'peak':>11}{'pickled':>11}{'build (traced)':>17}")
+    for name, build in (("objects", objects), ("dict + list", dicts), ("BeatmapStore", columns)):
+        kept, peak, pickled, elapsed = measure(build, filename)
+        print(f"{name:<16}{kept / mib:>7.1f} MiB{peak / mib:>7.1f} MiB{pickled / mib:>7.1f} MiB{elapsed * 1000:>14.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Shows what a --where expression costs: decoding osu!.db with the fields it needs on top of the
+default scan, and matching it against the resulting BeatmapStore. The first row decodes no optional
+field, which is what every scan without an expression does.
+
+usage: python benchmarks/bench_query.py <osu!.db> [expression ...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from query import Query  # noqa: E402
+from store import BeatmapColumns, BeatmapStore  # noqa: E402
+from utils import BEATMAP_FIELDS, SmallOsuDb  # noqa: E402
+
+EXPRESSIONS = [
+    "mode == mania or (last_played < 2y and not in_collection)",
+    "stars >= 5 and status in (ranked, loved)",
+    "drain_time < 90 and not played",
+]
+
+
+class NoProgress:
+    def start(self, total):
+        pass
+
+    def update(self, done):
+        pass
+
+
+def decode(filename, fields):
+    """Best of three single-process decodes with the given optional fields, returns seconds and the store."""
+    best = None
+    for _ in range(3):
+        columns = BeatmapColumns({name: BEATMAP_FIELDS[name][0] for name in fields})
+        start = time.perf_counter()
+        SmallOsuDb(filename, NoProgress(), columns=columns).inFile.close()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, BeatmapStore.merge([columns])
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__.strip())
+        sys.exit(2)
+    filename = sys.argv[1]
+    queries = [Query(text) for text in sys.argv[2:] or EXPRESSIONS]
+    baseline, store = decode(filename, ())
+    print(f"{'decode':>10}{'extra':>10}{'match':>10}{'matched':>10}  expression ({len(store):,} beatmaps)")
+    print(f"{baseline * 1000:>8.0f}ms{'':>10}{'':>10}{'':>10}  (none)")
+    hashes = {"collections": [], "scores": []}  # in_collection and has_scores match nothing here
+    for query in queries:
+        elapsed, store = decode(filename, sorted(query.fields))
+        start = time.perf_counter()
+        rows = query.rows(store, hashes)
+        match = time.perf_counter() - start
+        print(f"{elapsed * 1000:>8.0f}ms{(elapsed / baseline - 1) * 100:>9.0f}%{match * 1000:>8.1f}ms"
+              f"{len(rows):>10,}  {query.text}")
+
+
+if __name__ == "__main__":
+    main()
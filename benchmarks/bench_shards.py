@@ -0,0 +1,47 @@
+"""
+Shows how decoding an osu!.db scales with the number of worker processes.
+Pool start-up is not included, every run gets a warmed-up pool.
+
+usage: python benchmarks/bench_shards.py <osu!.db> [max processes]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import workers  # noqa: E402
+from utils import SmallOsuDb  # noqa: E402
+
+
+def run(filename, processes):
+    pool, _ = workers.create_pool(processes, processes)
+    try:
+        pool.apply(workers.load_beatmaps, (0, filename, 0, 0))  # make sure every worker has started
+        start = time.perf_counter()
+        tasks = []
+        for slot, (offset, count, _) in enumerate(SmallOsuDb.shards(filename, processes, 1)):
+            tasks.append(pool.apply_async(workers.load_beatmaps, (slot, filename, offset, count)))
+        store = workers.merge_beatmaps(task.get() for task in tasks)
+        return time.perf_counter() - start, len(store)
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__.strip())
+        sys.exit(2)
+    filename = sys.argv[1]
+    limit = int(sys.argv[2]) if len(sys.argv) > 2 else workers.MAX_PROCESSES
+    print(f"{'processes':>10}{'wall time':>13}{'speedup':>10}{'hashes':>10}")
+    baseline = None
+    for processes in range(1, limit + 1):
+        elapsed, hashes = run(filename, processes)
+        baseline = baseline or elapsed
+        print(f"{processes:>10}{elapsed * 1000:>10.0f} ms{baseline / elapsed:>9.2f}x{hashes:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Compares the two ways Engine.load_databases can read osu!'s databases:
+copying them to a tmp folder first (Engine.copy_to_tmp), or reading them in place as a read-only snapshot.
+
+Every run goes through Engine.load_databases with an empty scan cache, so all three databases get
+parsed. The time spent in Engine.copy_to_tmp is shown on its own, extra disk is the peak size of the
+tmp folder while the run lasts, sampled every few milliseconds. A snapshot only needs one if osu!
+writes to a database mid-read and the engine falls back to a copy.
+
+usage: python benchmarks/bench_snapshot.py <osu! folder> [repeats]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SAMPLE_INTERVAL = 0.005
+
+
+def folder_size(path):
+    size = 0
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    size += entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    pass  # removed while we looked
+    except FileNotFoundError:
+        pass
+    return size
+
+
+class PeakSize(threading.Thread):
+    """Samples the size of a folder until stopped, the largest one is in peak."""
+
+    def __init__(self, path):
+        super().__init__(daemon=True)
+        self.path = path
+        self.peak = 0
+        self.done = threading.Event()
+
+    def run(self):
+        while not self.done.wait(SAMPLE_INTERVAL):
+            self.peak = max(self.peak, folder_size(self.path))
+
+    def stop(self):
+        self.done.set()
+        self.join()
+        self.peak = max(self.peak, folder_size(self.path))
+        return self.peak
+
+
+def run(engine, snapshot, cache_dir):
+    """One load of every database, returns (seconds, seconds spent copying, peak bytes in tmp)."""
+    from core import Engine
+    from scancache import ScanCache
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    tmp = os.path.abspath("tmp")
+    shutil.rmtree(tmp, ignore_errors=True)
+    engine.snapshot = snapshot
+    copying = 0.0
+
+    def copy_to_tmp(file):
+        nonlocal copying
+        start = time.perf_counter()
+        try:
+            return Engine.copy_to_tmp(engine, file)
+        finally:
+            copying += time.perf_counter() - start
+
+    engine.copy_to_tmp = copy_to_tmp
+    sampler = PeakSize(tmp)
+    sampler.start()
+    cache = ScanCache()
+    try:
+        start = time.perf_counter()
+        engine.load_databases(cache)
+        elapsed = time.perf_counter() - start
+    finally:
+        cache.close()
+        peak = sampler.stop()
+        del engine.copy_to_tmp
+        shutil.rmtree(tmp, ignore_errors=True)
+    return elapsed, copying, peak
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__.strip())
+        sys.exit(2)
+    path = os.path.abspath(sys.argv[1])
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    work_dir = tempfile.mkdtemp(prefix="osu-cleaner-snapshot-")
+    cache_dir = os.path.join(work_dir, "cache")
+    os.environ["XDG_CACHE_HOME"] = os.environ["LOCALAPPDATA"] = cache_dir
+    os.chdir(work_dir)  # copies go to ./tmp
+    from core import Engine
+
+    engine = Engine()
+    engine.path = path
+    print(f"{'mode':<10}{'best wall time':>16}{'copying':>12}{'peak extra disk':>18}")
+    try:
+        for name, snapshot in (("copy", False), ("snapshot", True)):
+            results = [run(engine, snapshot, cache_dir) for _ in range(repeats)]
+            best, copying, _ = min(results)
+            disk = max(peak for _, _, peak in results)
+            print(f"{name:<10}{best * 1000:>13.1f} ms{copying * 1000:>9.1f} ms{disk / 1024 / 1024:>15.1f} MB")
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""
+Measures how long osu!cleaner takes to start: importing main.py and getting the window painted.
+Every run happens in a fresh interpreter, the medians are compared against the given budgets.
+
+usage: python benchmarks/bench_startup.py [--runs N] [--max-import-ms MS] [--max-paint-ms MS]
+exits with 1 if a median is over its budget.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def child():
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import main
+    imported = time.perf_counter()
+
+    from PyQt5.QtCore import QObject, QEvent, QTimer
+    from PyQt5.QtWidgets import QApplication
+
+    class FirstPaint(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint and not hasattr(self, "painted"):
+                self.painted = time.perf_counter()
+                # quit before detect_osu_path runs, a scan isn't part of start-up
+                QTimer.singleShot(0, app.quit)
+            return False
+
+    app = QApplication([])
+    app.setStyle("Fusion")
+    main.load_theme(app)
+    window = main.WindowWrapper()
+    first_paint = FirstPaint()
+    window.main_window.installEventFilter(first_paint)
+    window.show()
+    app.exec_()
+    print(json.dumps({"import_ms": (imported - start) * 1000, "paint_ms": (first_paint.painted - start) * 1000}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=500)
+    parser.add_argument("--max-paint-ms", type=float, default=1500)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        return child()
+
+    results = []
+    for _ in range(args.runs):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--child"],
+                                check=True, capture_output=True, text=True, cwd=ROOT).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    import_ms = statistics.median(r["import_ms"] for r in results)
+    paint_ms = statistics.median(r["paint_ms"] for r in results)
+    print(f"import main.py:       {import_ms:7.1f} ms (budget {args.max_import_ms:.0f} ms)")
+    print(f"time to first paint:  {paint_ms:7.1f} ms (budget {args.max_paint_ms:.0f} ms)")
+    if import_ms > args.max_import_ms or paint_ms > args.max_paint_ms:
+        print("over budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
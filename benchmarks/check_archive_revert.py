@@ -0,0 +1,117 @@
+"""
+Checks that Cleanup can still be reverted after part of it got deleted, with the folders packed into
+.osz archives (Engine.archive) as well as moved.
+
+For both modes it generates a small osu! folder (see generate.py), moves what filter(--keep) picks to
+Cleanup and then:
+    partial   deletes a few entries of Cleanup and reverts the rest
+    resumed   leaves a delete interrupted after its first entry, finishes it with recover and reverts the rest
+Afterwards Songs has to hold exactly the folders it started with minus the deleted ones, and Cleanup and
+its journal have to be gone. Exits with 1 if anything is off.
+
+usage: python benchmarks/check_archive_revert.py [--beatmaps 400] [--deleted 3]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def prepare(engine, keep):
+    engine.analyze()
+    engine.filter(keep)
+    report = engine.work()
+    assert not report.failed, report.summary()
+    return sorted(os.listdir(os.path.join(engine.path, "Cleanup")))
+
+
+def partial(engine, entries, deleted):
+    engine.delete_cleanup(entries[:deleted])
+    return entries[:deleted]
+
+
+def resumed(engine, entries, deleted):
+    from archiver import folder_name
+    from deleter import remove_folder
+    from journal import Journal
+    # what a delete killed right after its first entry leaves behind
+    journal = Journal(engine.path)
+    journal.begin("delete", [folder_name(entry) for entry in entries[:deleted]])
+    remove_folder(os.path.join(engine.path, "Cleanup", entries[0]))
+    journal.record(folder_name(entries[0]), True)
+    journal.close()
+    assert engine.interrupted_run() is not None, "the delete doesn't show up as interrupted"
+    engine.recover(resume=True)
+    return entries[:deleted]
+
+
+def check(engine, archive, scenario, keep, deleted):
+    """Runs one scenario and returns what went wrong, an empty list if nothing did."""
+    from archiver import folder_name
+    songs = os.path.join(engine.path, "Songs")
+    before = set(os.listdir(songs))
+    engine.archive = archive
+    entries = prepare(engine, keep)
+    if len(entries) <= deleted:
+        return [f"only {len(entries)} folders got moved to Cleanup, use a bigger --beatmaps"]
+    if archive and not all(entry.endswith(".osz") for entry in entries):
+        return ["work didn't pack every folder into an archive"]
+    gone = {folder_name(entry) for entry in scenario(engine, entries, deleted)}
+    warnings = []
+    engine.on_warning = warnings.append
+    report = engine.revert()
+    engine.on_warning = lambda message: None
+    problems = [f"revert failed on {folder}: {error}" for folder, error in report.failed]
+    problems += [f"warning: {message.splitlines()[0]}" for message in warnings]
+    if os.path.exists(os.path.join(engine.path, "Cleanup")):
+        problems.append("Cleanup is still there")
+    if os.path.exists(os.path.join(engine.path, "Cleanup.journal")):
+        problems.append("the journal is still there")
+    after = set(os.listdir(songs))
+    if after != before - gone:
+        problems.append(f"Songs has {len(after)} folders, expected {len(before - gone)}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--beatmaps", type=int, default=400)
+    parser.add_argument("--deleted", type=int, default=3, help="entries of Cleanup deleted before reverting")
+    parser.add_argument("--keep", nargs="+", default=["scores"])
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="osu-cleaner-revert-")
+    cache_dir = os.path.join(work_dir, "cache")
+    os.environ["XDG_CACHE_HOME"] = os.environ["LOCALAPPDATA"] = cache_dir
+    os.chdir(work_dir)  # copies go to ./tmp
+    from core import Engine
+    from generate import generate
+
+    failed = False
+    try:
+        for archive in (True, False):
+            for scenario in (partial, resumed):
+                path = os.path.join(work_dir, f"osu-{archive}-{scenario.__name__}")
+                generate(path, args.beatmaps)
+                engine = Engine()
+                engine.path = path
+                problems = check(engine, archive, scenario, args.keep, args.deleted)
+                name = f"{'archive' if archive else 'move'} {scenario.__name__}"
+                print(f"{name:<18}{'ok' if not problems else 'FAILED'}")
+                for problem in problems:
+                    print(f"    {problem}")
+                failed = failed or bool(problems)
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
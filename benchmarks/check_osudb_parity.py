@@ -0,0 +1,204 @@
+"""
+Checks that SmallOsuDb decodes generated osu!.db files (see generate.py) exactly like a plain reader that
+reads every field in order, the way SmallBeatmapMetadata.fromOsuDb did through osu.py before.
+
+Every version around the format changes gets its own file: entry size prefixes before 20191106, byte
+difficulties without star ratings before 20140609 and double star ratings before 20250107. Per beatmap
+it compares hash, beatmapFile, lastEdit, lastPlayed and directory of SmallBeatmapMetadata, and digest,
+directory, lastPlayed and every field of utils.BEATMAP_FIELDS of the columns, decoded whole and in shards.
+Exits with 1 if any version doesn't match.
+
+usage: python benchmarks/check_osudb_parity.py [--beatmaps 2000] [--versions 20140609 ...]
+"""
+import argparse
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from generate import DEFAULT_VERSION, generate  # noqa: E402
+from store import BeatmapColumns, BeatmapStore  # noqa: E402
+from utils import (BEATMAP_FIELDS, VERSION_FLOAT_DIFFICULTY, VERSION_FLOAT_STAR_RATING,  # noqa: E402
+                   VERSION_NO_ENTRY_SIZE, SmallOsuDb, ticks_to_datetime)
+
+VERSIONS = [20130101, VERSION_FLOAT_DIFFICULTY - 1, VERSION_FLOAT_DIFFICULTY, VERSION_NO_ENTRY_SIZE - 1,
+            VERSION_NO_ENTRY_SIZE, VERSION_FLOAT_STAR_RATING - 1, VERSION_FLOAT_STAR_RATING, DEFAULT_VERSION]
+
+
+class NoProgress:
+    def start(self, total):
+        pass
+
+    def update(self, done):
+        pass
+
+
+class Reader:
+    """Reads osu!'s types one after the other, like osu.py's BinaryFile."""
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def read(self, fmt):
+        values = struct.unpack_from("<" + fmt, self.buf, self.pos)
+        self.pos += struct.calcsize("<" + fmt)
+        return values[0] if len(values) == 1 else values
+
+    def string(self):
+        if self.read("B") == 0:
+            return ""
+        length = shift = 0
+        while True:
+            byte = self.read("B")
+            length |= (byte & 0x7f) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+        self.pos += length
+        return self.buf[self.pos - length:self.pos].decode("utf-8")
+
+    def any(self):
+        kind = self.read("B")
+        return self.read({0x08: "i", 0x0c: "f", 0x0d: "d"}[kind])
+
+
+def reference(filename):
+    """Every beatmap of an osu!.db as a dict, read field by field."""
+    with open(filename, "rb") as f:
+        r = Reader(f.read())
+    version = r.read("i")
+    r.read("iBq")  # mapsetCount, accountUnlocked, unrestrictionTime
+    r.string()  # username
+    beatmaps = []
+    for _ in range(r.read("i")):
+        if version < VERSION_NO_ENTRY_SIZE:
+            r.read("i")  # entry size
+        bm = {}
+        for _ in range(7):  # artistA, artistU, titleA, titleU, creator, diffName, audioFile
+            r.string()
+        bm["hash"] = r.string()
+        bm["beatmapFile"] = r.string()
+        bm["status"], _, _, _, bm["last_edit"] = r.read("Bhhhq")  # state, circles, sliders, spinners, lastEdit
+        difficulty = r.read("BBBB" if version < VERSION_FLOAT_DIFFICULTY else "ffff")
+        bm["ar"], bm["cs"], bm["hp"], bm["od"] = map(float, difficulty)
+        r.read("d")  # SV
+        ratings = []
+        if version >= VERSION_FLOAT_DIFFICULTY:
+            for _ in range(4):  # std, taiko, ctb, mania
+                ratings.append([(r.any(), r.any()) for _ in range(r.read("i"))])
+        bm["drain_time"], bm["total_time"], _ = r.read("iii")  # drain, total, preview time
+        for _ in range(r.read("i")):
+            r.read("dd?")  # bpm, offset, inherited
+        bm["beatmap_id"], bm["mapset_id"], _ = r.read("iii")  # mapID, mapsetID, threadID
+        r.read("BBBBhf")  # grades, offset, stackLeniency
+        bm["mode"] = r.read("B")
+        r.string()  # source
+        r.string()  # tags
+        r.read("h")  # onlineOffset
+        r.string()  # onlineTitle
+        r.read("?")  # isNew
+        bm["last_played"] = r.read("q")
+        r.read("?")  # osz2
+        bm["directory"] = r.string()
+        r.read("q????hi")  # lastSync, disable* flags, bgDim, last modification
+        if version < VERSION_FLOAT_DIFFICULTY:
+            r.read("h")
+        own = ratings[bm["mode"]] if bm["mode"] < len(ratings) else []
+        bm["stars"] = next((float(stars) for mods, stars in own if mods == 0), 0.0)
+        beatmaps.append(bm)
+    r.read("i")  # permissions
+    assert r.pos == len(r.buf), f"{len(r.buf) - r.pos} bytes left after the last beatmap"
+    return beatmaps
+
+
+def single(value):
+    """value as a float32 column stores it."""
+    return array("f", [value])[0]
+
+
+def columns_of(filename, offset=None, count=None):
+    columns = BeatmapColumns({name: typecode for name, (typecode, _) in BEATMAP_FIELDS.items()})
+    SmallOsuDb(filename, NoProgress(), offset, count, columns=columns).inFile.close()
+    return columns
+
+
+def compare(filename):
+    """Returns the mismatches between SmallOsuDb and the plain reader, as text."""
+    expected = reference(filename)
+    problems = []
+
+    db = SmallOsuDb(filename, NoProgress())
+    db.inFile.close()
+    if len(db.beatmaps) != len(expected):
+        return [f"{len(db.beatmaps)} beatmaps instead of {len(expected)}"]
+    for i, (bm, ref) in enumerate(zip(db.beatmaps, expected)):
+        actual = (bm.hash, bm.beatmapFile, bm.lastEdit, bm.lastPlayed, bm.directory)
+        wanted = (ref["hash"], ref["beatmapFile"], ticks_to_datetime(ref["last_edit"]),
+                  ticks_to_datetime(ref["last_played"]), ref["directory"])
+        if actual != wanted:
+            problems.append(f"beatmap {i}: SmallBeatmapMetadata has {actual}, expected {wanted}")
+
+    whole = columns_of(filename)
+    parts = [columns_of(filename, offset, count) for offset, count, _ in SmallOsuDb.shards(filename, 3, 100)]
+    if sum(map(len, parts)) != len(whole):
+        problems.append(f"shards hold {sum(map(len, parts))} beatmaps instead of {len(whole)}")
+    decoded = [("columns", 0, whole)]
+    first = 0
+    for k, part in enumerate(parts):
+        decoded.append((f"shard {k}", first, part))
+        first += len(part)
+    for name, first, columns in decoded:
+        for row in range(len(columns)):
+            ref = expected[first + row]
+            actual = {"hash": columns.digests[row * 16:(row + 1) * 16].hex(),
+                      "directory": columns.directories[columns.directory_ids[row]],
+                      "last_played": columns.last_played[row],
+                      **{field: column[row] for field, column in columns.fields.items()}}
+            wanted = {field: single(ref[field]) if BEATMAP_FIELDS.get(field, ("",))[0] == "f" else ref[field]
+                      for field in actual}
+            if actual != wanted:
+                fields = ", ".join(f"{field} {actual[field]!r} != {wanted[field]!r}"
+                                   for field in actual if actual[field] != wanted[field])
+                problems.append(f"beatmap {first + row}, {name}: {fields}")
+    store = BeatmapStore.merge(parts)
+    if len(store) != len(expected):
+        problems.append(f"merged store holds {len(store)} beatmaps instead of {len(expected)}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--beatmaps", type=int, default=2000)
+    parser.add_argument("--versions", type=int, nargs="+", default=VERSIONS)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="osu-cleaner-parity-")
+    failed = False
+    try:
+        for version in args.versions:
+            path = os.path.join(work_dir, str(version))
+            generate(path, args.beatmaps, version=version, songs=False)
+            try:
+                problems = compare(os.path.join(path, "osu!.db"))
+            except Exception as err:  # a decoder that loses its place in the file usually reads past its end
+                problems = [f"decoding failed: {err!r}"]
+            print(f"{version}  {'ok' if not problems else f'{len(problems)} mismatches'}")
+            for problem in problems[:10]:
+                print(f"    {problem}")
+            failed = failed or bool(problems)
+            shutil.rmtree(path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
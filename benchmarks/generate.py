@@ -0,0 +1,184 @@
+"""
+Writes a synthetic osu! folder: osu!.db, collection.db, scores.db and a matching Songs tree.
+
+Every beatmap set gets its own folder in Songs with one .osu file per difficulty, so Logic.analyze,
+Logic.filter and Logic.work can be run against it without a real osu! install.
+
+usage: python benchmarks/generate.py <folder> [--beatmaps N] [--per-set N] [--collections N]
+                                     [--collection-size N] [--score-density X] [--played X] ...
+"""
+import argparse
+import hashlib
+import os
+import random
+import struct
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import VERSION_FLOAT_DIFFICULTY, VERSION_FLOAT_STAR_RATING, VERSION_NO_ENTRY_SIZE  # noqa: E402
+
+DEFAULT_VERSION = 20250108
+_TICKS_2020 = 637134336000000000  # 2020-01-01 in .NET ticks
+_DAY = 864000000000
+
+
+def osu_string(text):
+    """Encodes text the way osu! writes strings, None becomes the empty marker."""
+    if text is None:
+        return b"\x00"
+    data = text.encode("utf-8")
+    length = len(data)
+    out = bytearray(b"\x0b")
+    while True:
+        byte = length & 0x7f
+        length >>= 7
+        out.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(out) + data
+
+
+def beatmap_hash(seed, i):
+    return hashlib.md5(f"{seed}:{i}".encode()).hexdigest()
+
+
+def beatmap_entry(rng, version, h, i, set_id, directory, osu_file, last_played):
+    # status, mode, star rating and length follow from the ids, so rng draws the same numbers as it always did
+    status = (2, 4, 4, 4, 7)[set_id % 5]  # graveyard, ranked, loved
+    mode = set_id % 4
+    stars = 1.5 + i % 7 * 0.75
+    drain = 60 + set_id * 37 % 240
+    out = bytearray()
+    out += osu_string(f"Artist {set_id}") + osu_string(None) + osu_string(f"Title {set_id}") + osu_string(None)
+    out += osu_string("mapper") + osu_string(f"Diff {i}") + osu_string("audio.mp3")
+    out += osu_string(h) + osu_string(osu_file)
+    out += struct.pack("<Bhhhq", status, 200, 50, 2, _TICKS_2020 - rng.randrange(3650) * _DAY)
+    if version < VERSION_FLOAT_DIFFICULTY:
+        out += struct.pack("<BBBBd", 9, 4, 5, 8, 1.4)
+    else:
+        out += struct.pack("<ffffd", 9, 4, 5, 8, 1.4)
+        for ruleset in range(4):  # std, taiko, ctb, mania
+            count = rng.randrange(4)
+            out += struct.pack("<i", count)
+            for mods in range(count):
+                rating = stars * (1.3 if mods else 1) if ruleset == mode else 5.5
+                if version >= VERSION_FLOAT_STAR_RATING:
+                    out += struct.pack("<BiBf", 0x08, mods, 0x0c, rating)
+                else:
+                    out += struct.pack("<BiBd", 0x08, mods, 0x0d, rating)
+    out += struct.pack("<iii", drain, drain * 1000 + 5000, 40000)  # drain, total, preview time
+    timing_points = rng.randint(1, 4)
+    out += struct.pack("<i", timing_points)
+    for point in range(timing_points):
+        out += struct.pack("<dd?", 333.3, point * 1000.0, True)
+    out += struct.pack("<iii", i + 1, set_id + 1, 0)
+    out += bytes([9, 9, 9, 9])  # grades
+    out += struct.pack("<hfB", 0, 0.7, mode)  # offset, stack leniency, mode
+    out += osu_string("source") + osu_string(" ".join(["tag"] * rng.randrange(20)))
+    out += struct.pack("<h", 0) + osu_string(None) + struct.pack("<?", not last_played)
+    out += struct.pack("<q?", last_played, False) + osu_string(directory)
+    out += struct.pack("<q", 0) + bytes(5) + struct.pack("<iB", 0, 0)
+    if version < VERSION_FLOAT_DIFFICULTY:
+        out += struct.pack("<h", 0)
+    if version < VERSION_NO_ENTRY_SIZE:
+        out[:0] = struct.pack("<i", len(out))
+    return out
+
+
+def score_record(rng, version, h, target_practice):
+    mods = 1 << 23 if target_practice else 0
+    out = bytearray(struct.pack("<Bi", 0, version))
+    out += osu_string(h) + osu_string("player") + osu_string(hashlib.md5(rng.randbytes(8)).hexdigest())
+    out += struct.pack("<hhhhhhih?i", 300, 20, 1, 40, 10, 2, rng.randrange(10 ** 7), 500, False, mods)
+    out += osu_string(None)  # life bar graph
+    out += struct.pack("<qiq", _TICKS_2020 + rng.randrange(1000) * _DAY, -1, rng.randrange(1 << 40))
+    if target_practice:
+        out += struct.pack("<d", 0.95)
+    return out
+
+
+def generate(path, beatmaps=10000, per_set=4, collections=20, collection_size=100, score_density=0.1,
+             max_scores=3, played=0.3, version=DEFAULT_VERSION, seed=1, songs=True, osu_files=True):
+    """Writes the folder and returns a summary of what is in it."""
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    songs_path = os.path.join(path, "Songs")
+    os.makedirs(songs_path, exist_ok=True)
+    hashes = []
+    played_count = 0
+    sets = -(-beatmaps // per_set)
+
+    with open(os.path.join(path, "osu!.db"), "wb") as f:
+        f.write(struct.pack("<iiBq", version, sets, 1, 0) + osu_string("player") + struct.pack("<i", beatmaps))
+        for i in range(beatmaps):
+            set_id = i // per_set
+            directory = f"{set_id + 1} Artist {set_id} - Title {set_id}"
+            osu_file = f"Artist {set_id} - Title {set_id} (mapper) [Diff {i}].osu"
+            h = beatmap_hash(seed, i)
+            last_played = _TICKS_2020 + rng.randrange(2000) * _DAY if rng.random() < played else 0
+            played_count += last_played != 0
+            hashes.append(h)
+            f.write(beatmap_entry(rng, version, h, i, set_id, directory, osu_file, last_played))
+            if songs:
+                folder = os.path.join(songs_path, directory)
+                if i % per_set == 0:
+                    os.makedirs(folder, exist_ok=True)
+                if osu_files:
+                    with open(os.path.join(folder, osu_file), "w") as osu:
+                        osu.write(f"osu file format v14\n\n[Metadata]\nBeatmapID:{i + 1}\n")
+        f.write(struct.pack("<i", 0))  # user permissions
+
+    in_collections = set()
+    with open(os.path.join(path, "collection.db"), "wb") as f:
+        f.write(struct.pack("<ii", version, collections))
+        for k in range(collections):
+            members = rng.sample(hashes, min(collection_size, len(hashes)))
+            in_collections.update(members)
+            f.write(osu_string(f"Collection {k}") + struct.pack("<i", len(members)))
+            f.write(b"".join(osu_string(h) for h in members))
+
+    scored = rng.sample(hashes, int(len(hashes) * score_density))
+    with open(os.path.join(path, "scores.db"), "wb") as f:
+        f.write(struct.pack("<ii", version, len(scored)))
+        for h in scored:
+            count = rng.randint(1, max_scores)
+            f.write(osu_string(h) + struct.pack("<i", count))
+            for _ in range(count):
+                f.write(score_record(rng, version, h, rng.random() < 0.05))
+
+    open(os.path.join(path, "osu!.exe"), "wb").close()
+    return {
+        "beatmaps": beatmaps,
+        "sets": sets,
+        "collections": collections,
+        "in_collections": len(in_collections),
+        "scored": len(scored),
+        "played": played_count,
+        "version": version,
+        "seed": seed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a synthetic osu! folder.")
+    parser.add_argument("path")
+    parser.add_argument("--beatmaps", type=int, default=10000, help="difficulties in osu!.db")
+    parser.add_argument("--per-set", type=int, default=4, help="difficulties per beatmap set / Songs folder")
+    parser.add_argument("--collections", type=int, default=20)
+    parser.add_argument("--collection-size", type=int, default=100, help="beatmaps per collection")
+    parser.add_argument("--score-density", type=float, default=0.1, help="fraction of beatmaps with scores")
+    parser.add_argument("--max-scores", type=int, default=3, help="most scores per beatmap")
+    parser.add_argument("--played", type=float, default=0.3, help="fraction of beatmaps played at least once")
+    parser.add_argument("--version", type=int, default=DEFAULT_VERSION, help="osu! version written to the headers")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-songs", action="store_true", help="only write the databases")
+    parser.add_argument("--no-osu-files", action="store_true", help="create the Songs folders but leave them empty")
+    args = parser.parse_args()
+    summary = generate(args.path, args.beatmaps, args.per_set, args.collections, args.collection_size,
+                       args.score_density, args.max_scores, args.played, args.version, args.seed,
+                       not args.no_songs, not args.no_osu_files)
+    print(summary)
+
+
+if __name__ == "__main__":
+    main()
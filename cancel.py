@@ -0,0 +1,89 @@
+"""
+Cooperative cancellation of whatever the engine is running, see Engine.cancel_token.
+
+A token is a flag another thread sets. Every loop of a scan, a plan or a move checks it often enough
+that cancelling takes effect within about MAX_LATENCY: per item when items are slow (folders, files,
+chunks of a copy) and every CHECK_EVERY items when they are cheap (beatmaps, hashes). Loops that can
+stop cleanly take a stopped() callable and return early, deeper ones raise Cancelled, which the
+entry points of Engine catch. Worker processes don't check anything, the pool gets terminated instead.
+"""
+import threading
+from concurrent.futures import FIRST_COMPLETED, wait
+
+CHECK_EVERY = 4096  # items of a hot loop between two checks, a few milliseconds of work
+MAX_LATENCY = 0.1  # seconds, what benchmarks/bench_cancel.py holds every phase to
+
+
+class Cancelled(Exception):
+    """Raised out of a deep loop once its token got cancelled."""
+
+
+class CancelToken:
+    """
+    Thread-safe cancellation flag. Calling it tells whether it got cancelled, so the token itself
+    can be passed wherever a stopped() callable is expected.
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+
+    def __call__(self):
+        return self.event.is_set()
+
+    def cancel(self):
+        self.event.set()
+
+    def reset(self):
+        self.event.clear()
+
+    def check(self):
+        if self.event.is_set():
+            raise Cancelled()
+
+    def wait(self, timeout):
+        """Sleeps for timeout seconds or until the token gets cancelled, returns whether it did."""
+        return self.event.wait(timeout)
+
+
+def checked(iterable, stopped, every=CHECK_EVERY):
+    """Yields from iterable and raises Cancelled once stopped() turns true, checked every `every` items."""
+    if stopped is None:
+        yield from iterable
+        return
+    for i, item in enumerate(iterable):
+        if not i % every and stopped():
+            raise Cancelled()
+        yield item
+
+
+def bounded_jobs(submit, items, limit, stopped=None, timeout=None):
+    """
+    Yields (item, future) for every item as soon as its job is done, with at most limit jobs submitted at a time.
+
+    submit(item) starts the job of item on a pool and returns its future, or None if it has nothing to wait for.
+    Only a few jobs are queued because cancelling thousands of queued ones takes a while. Once stopped() turns
+    true no further item gets submitted, the jobs already running are still yielded. stopped() gets checked
+    before every submit and after every wait, timeout caps how long a wait takes.
+    """
+    pending = iter(items)
+    running = {}
+    stopping = False
+    while True:
+        while len(running) < limit and not stopping:
+            if stopped is not None and stopped():
+                stopping = True
+                break
+            try:
+                item = next(pending)
+            except StopIteration:
+                break
+            future = submit(item)
+            if future is not None:
+                running[future] = item
+        if not running:
+            return
+        completed, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not stopping and stopped is not None and stopped():
+            stopping = True
+        for future in completed:
+            yield running.pop(future), future
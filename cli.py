@@ -0,0 +1,241 @@
+"""
+Command line interface for osu!cleaner, runs the same engine as the GUI without needing Qt.
+
+    python cli.py --path "C:/osu!" analyze
+    python cli.py --path "C:/osu!" watch
+    python cli.py --path "C:/osu!" plan --keep collections scores played
+    python cli.py --path "C:/osu!" apply --keep collections scores
+    python cli.py --path "C:/osu!" apply --keep collections scores --orphans --duplicates
+    python cli.py --path "C:/osu!" apply --keep collections scores --archive
+    python cli.py --path "C:/osu!" apply --keep collections --where "mode == mania or last_played < 1y"
+    python cli.py --path "C:/osu!" revert
+    python cli.py --path "C:/osu!" delete
+
+Results are printed to stdout as JSON, progress and warnings go to stderr.
+--trace trace.json records how long every phase took, see tracing.py.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+import tracing
+from core import Engine, FILTERS
+from query import Query, QueryError
+from utils import get_osu_path
+
+REQUIRED_FILES = ["osu!.db", "collection.db", "scores.db", "Songs"]
+
+
+class ConsoleReporter:
+    def __init__(self, quiet):
+        self.quiet = quiet
+        self.maximum = 0
+        self.warnings = []
+
+    def status(self, message):
+        if not self.quiet:
+            print(f"\r{message:<64}", file=sys.stderr, flush=True)  # also overwrites the last progress line
+
+    def init_progress(self, maximum):
+        self.maximum = maximum
+
+    def progress(self, value):
+        if not self.quiet and self.maximum > 0:
+            print(f"\r{100 * value / self.maximum:5.1f}%", end="", file=sys.stderr, flush=True)
+
+    def warning(self, message):
+        self.warnings.append(message)
+        print(f"\rwarning: {message}", file=sys.stderr, flush=True)
+
+
+def failed_folders(report):
+    return [{"folder": os.path.basename(src), "error": error} for src, error in report.failed]
+
+
+def failed_deletes(report):
+    return [{"folder": folder, "error": error} for folder, error in report.failed]
+
+
+def analyze(engine, args):
+    if args.where:
+        engine.where(args.where)  # before the scan, so it decodes the fields the expression needs right away
+    if not engine.analyze():
+        sys.exit(1)
+    return counts(engine)
+
+
+def counts(engine):
+    return {
+        "folders": len(engine.index),
+        "hashes": {name: len(hashes) for name, hashes in engine.hashes.items()},
+        "orphans": len(engine.orphans),
+        "duplicates": len(engine.duplicates),
+        "missing": len(engine.missing),
+    }
+
+
+def select(engine, args):
+    result = analyze(engine, args)
+    keep = args.keep + ["where"] if args.where else args.keep
+    total, remove = engine.filter(keep, args.orphans, args.duplicates)
+    result.update(keep=keep, remove=remove, remaining=total - remove)
+    return result
+
+
+def plan(engine, args):
+    result = select(engine, args)
+    sizes = engine.plan()
+    if sizes is None:
+        sys.exit(1)
+    result.update(
+        bytes=sizes.total_bytes,
+        files=sizes.files,
+        largest=[{"folder": folder, "bytes": size} for folder, size in sizes.largest(args.largest)],
+        by_filter={name: {"folders": folders, "bytes": size} for name, (folders, size) in sizes.by_filter.items()},
+        folders_to_move=engine.paths_to_delete,
+    )
+    return result
+
+
+def recover(engine, args):
+    run = engine.interrupted_run()
+    if run is None:
+        return None
+    if args.recover is None:
+        sys.exit(f"error: an earlier {run.action} run got interrupted, pass --recover resume or --recover undo")
+    report = engine.recover(args.recover == "resume")
+    if run.action == "delete":
+        return {"action": run.action, "deleted": len(report.deleted) if report else 0,
+                "failed": failed_deletes(report) if report else []}
+    return {"action": run.action, args.recover: len(report.moved), "failed": failed_folders(report)}
+
+
+def apply(engine, args):
+    recovered = recover(engine, args)
+    result = select(engine, args)
+    engine.archive = args.archive
+    report = engine.work()
+    result.update(recovered=recovered, moved=len(report.moved), failed=failed_folders(report))
+    if args.archive:
+        result.update(bytes=report.size, archive_bytes=report.packed)
+    return result
+
+
+def revert(engine, args):
+    recovered = recover(engine, args)
+    report = engine.revert()
+    return {"recovered": recovered, "reverted": len(report.moved), "failed": failed_folders(report)}
+
+
+def watch(engine, args):
+    """Prints the counts after the first scan and again after every change, until interrupted."""
+    from queue import Empty, Queue
+    from watcher import Watcher
+    print(json.dumps(analyze(engine, args), ensure_ascii=False), flush=True)
+    changes = Queue()
+    watcher = Watcher(engine.path, changes.put, args.interval).start()
+    refreshes = 0
+    try:
+        while True:
+            try:
+                changed = changes.get(timeout=1)  # with a timeout so Ctrl+C gets through on Windows
+            except Empty:
+                continue
+            while not changes.empty():
+                changed |= changes.get()
+            if not engine.refresh(changed):
+                sys.exit(1)
+            refreshes += 1
+            print(json.dumps({"changed": sorted(changed), **counts(engine)}, ensure_ascii=False), flush=True)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
+    return {"mode": watcher.mode, "refreshes": refreshes}
+
+
+def delete(engine, args):
+    recovered = recover(engine, args)
+    report = engine.delete_cleanup()
+    return {"recovered": recovered, "deleted": len(report.deleted), "bytes": report.bytes, "files": report.files,
+            "failed": failed_deletes(report)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="osu!cleaner", description="Clean up your osu! Library with ease.")
+    parser.add_argument("--path", help="osu! folder, detected from the registry on Windows if left out")
+    parser.add_argument("--quiet", action="store_true", help="don't print progress to stderr")
+    parser.add_argument("--copy", action="store_true", help="parse copies of the databases instead of the originals")
+    parser.add_argument("--hash-files", action="store_true",
+                        help="hash the files of folders osu!.db doesn't list to find copies among them too")
+    parser.add_argument("--trace", metavar="FILE", default=os.environ.get(tracing.ENV_VARIABLE),
+                        help="write a Chrome trace of every phase to FILE and print a summary to stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("analyze", help="scan the databases and count the hashes of every filter")
+    command.add_argument("--where", metavar="EXPRESSION", help="also count the beatmaps an expression matches")
+    command = commands.add_parser("watch", help="analyze, then keep the counts up to date while osu! changes "
+                                                "its databases or Songs, until interrupted")
+    command.add_argument("--interval", type=float, default=2.0,
+                         help="seconds between two checks where inotify isn't available")
+    command.add_argument("--where", metavar="EXPRESSION", help="also count the beatmaps an expression matches")
+    for name, command_help in (("plan", "list the folders that would be moved and how much space they take up, "
+                                        "without moving anything"),
+                               ("apply", "move every folder that none of the filters keep to Cleanup")):
+        command = commands.add_parser(name, help=command_help)
+        command.add_argument("--keep", nargs="+", choices=FILTERS, default=[],
+                             help="keep beatmaps matching any of these filters")
+        command.add_argument("--where", metavar="EXPRESSION",
+                             help="also keep beatmaps matching an expression like "
+                                  "\"mode == mania or (last_played < 2y and not in_collection)\", see query.py")
+        command.add_argument("--orphans", action="store_true",
+                             help="also move the folders in Songs that osu!.db doesn't list")
+        command.add_argument("--duplicates", action="store_true",
+                             help="also move the folders whose beatmaps are all in another folder too")
+    commands.choices["apply"].add_argument("--archive", action="store_true",
+                                           help="pack every folder into an .osz archive in Cleanup instead of "
+                                                "moving it there as is")
+    commands.choices["plan"].add_argument("--largest", type=int, default=10, metavar="N",
+                                          help="how many of the largest folders to list")
+    for command in (commands.choices["apply"], commands.add_parser("revert", help="move everything back from Cleanup"),
+                    commands.add_parser("delete", help="delete everything in Cleanup for good")):
+        command.add_argument("--recover", choices=["resume", "undo"],
+                             help="what to do with an interrupted earlier run")
+    args = parser.parse_args(argv)
+    if args.command in ("plan", "apply") and not args.keep and not args.where:
+        parser.error("pass --keep, --where or both, without any filter every folder would be moved")
+    if getattr(args, "where", None):
+        try:
+            Query(args.where)
+        except QueryError as err:
+            parser.error(f"--where: {err}")
+    if args.trace:
+        tracing.enable(args.trace)
+
+    path = args.path
+    if path is None:
+        path = get_osu_path() if sys.platform == "win32" else None
+        if not path:
+            parser.error("couldn't detect the osu! folder, pass --path")
+    missing = [file for file in REQUIRED_FILES if not os.path.exists(os.path.join(path, file))]
+    if missing:
+        parser.error(f"{path} doesn't look like an osu! folder, missing: {', '.join(missing)}")
+
+    reporter = ConsoleReporter(args.quiet)
+    engine = Engine(on_status=reporter.status, on_init_progress=reporter.init_progress,
+                    on_progress=reporter.progress, on_warning=reporter.warning)
+    engine.path = str(path)
+    engine.snapshot = not args.copy
+    engine.hash_files = args.hash_files
+    command = {"analyze": analyze, "plan": plan, "apply": apply, "revert": revert, "delete": delete,
+               "watch": watch}[args.command]
+    result = command(engine, args)
+    result = {"path": str(path), "command": args.command, **result, "warnings": reporter.warnings}
+    print(json.dumps(result, indent=2, ensure_ascii=False))
+    return 1 if result.get("failed") else 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
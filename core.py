@@ -0,0 +1,717 @@
+"""
+The scan / filter / move engine behind osu!cleaner.
+
+Nothing in here imports Qt, progress and messages are reported through plain callbacks.
+The GUI wraps it in objects.Logic, cli.py drives it directly.
+"""
+import os
+import shutil
+import threading
+import traceback
+
+import tracing
+from cancel import Cancelled, CancelToken
+from index import DirectoryIndex
+from journal import Journal
+from progress import Reporter
+from songs import diff_songs, list_folders
+from store import BeatmapStore
+from utils import SmallOsuDb, file_signature
+
+# names of the loaders in workers. workers, scancache and mover pull in multiprocessing, sqlite3 and
+# concurrent.futures, so they are only imported once a scan or move actually needs them
+LOADERS = {
+    "collection.db": "load_collections",
+    "scores.db": "load_scores",
+    "osu!.db": "load_beatmaps",
+}
+FILTERS = ["collections", "scores", "played"]
+COPY_CHUNK = 1024 * 1024  # bytes copied between two checks of the cancel token, tens of milliseconds on a slow drive
+
+
+def _ignore(*args):
+    pass
+
+
+class Engine:
+    def __init__(self, on_status=None, on_init_progress=None, on_progress=None, on_warning=None):
+        # on_init_progress(maximum): 0 means busy without known progress, -1 means idle
+        self.progress = Reporter(on_status, on_init_progress, on_progress)
+        self.on_warning = on_warning or _ignore
+        # cancelling it stops whatever runs within about cancel.MAX_LATENCY, reset() clears it again
+        self.cancel_token = CancelToken()
+        self.path = ""
+        self.hashes = {}
+        self.beatmaps = BeatmapStore()
+        self.collection_names = []
+        self.collection_membership = {}
+        self.score_counts = {}
+        self.index = DirectoryIndex()
+        self.orphans = []  # folders in Songs that osu!.db doesn't list
+        self.missing = set()  # folders osu!.db lists that aren't in Songs
+        self.duplicates = {}  # folder -> folder that has all of its beatmaps
+        self.filters = []
+        self.paths_to_delete = []
+        self.snapshot = True  # read osu!'s databases in place instead of copying them to tmp first
+        self.lock = threading.Lock()  # keeps filter() from seeing half of a refresh()
+        self.hash_files = False  # also look for copies among the orphans by hashing their files
+        self.archive = False  # work() packs the folders into .osz archives in Cleanup instead, see archiver.py
+        self.query = None  # query.Query whose beatmaps the "where" filter keeps, see where()
+
+    def reset(self):
+        self.cancel_token.reset()
+        self.path = ""
+        self.hashes = {}
+        self.beatmaps = BeatmapStore()
+        self.collection_names = []
+        self.collection_membership = {}
+        self.score_counts = {}
+        self.index = DirectoryIndex()
+        self.orphans = []
+        self.missing = set()
+        self.duplicates = {}
+
+    @tracing.traced("work")
+    def work(self):
+        self.progress.start(len(self.paths_to_delete), "Starting moving")
+        if not os.path.exists(os.path.join(self.path, "Cleanup")):
+            # whatever an old journal says was in there is gone with it
+            Journal(self.path).remove()
+            os.mkdir(os.path.join(self.path, "Cleanup"))
+        report = self.move("archive" if self.archive else "work", self.paths_to_delete)
+        if report.failed:
+            self.on_warning(f"Couldn't move {len(report.failed)} folder(s), they are still in Songs:\n"
+                            + report.summary())
+        if report.stopped:
+            self.progress.stop()  # whoever cancelled us owns the status line now
+        else:
+            self.progress.finish("waiting for user action...")
+        return report
+
+    @tracing.traced("revert")
+    def revert(self):
+        from archiver import archive_path, remove_partials
+        self.progress.status("Reverting Cleanup")
+        cleanup = os.path.join(self.path, "Cleanup")
+        remove_partials(cleanup)
+        journal = Journal(self.path)
+        if journal.exists():
+            folders, _ = journal.replay()
+            # folders deleted from Cleanup by hand are gone, not failed moves
+            present = [folder for folder in folders if os.path.lexists(os.path.join(cleanup, folder))
+                       or os.path.lexists(archive_path(cleanup, folder))]
+            tracing.count("journaled folders gone", len(folders) - len(present))
+            folders = present
+        else:
+            folders = self.cleanup_folders()
+        self.progress.start(len(folders))
+        report = self.move("revert", folders)
+        if not report.failed and not report.stopped:
+            # anything still in there was moved by hand or before the journal existed
+            leftovers = self.cleanup_folders()
+            if leftovers:
+                self.progress.start(len(leftovers))
+                report = self.move("revert", leftovers)
+        if report.failed:
+            # keep the Cleanup folder, it still holds the folders that couldn't be moved back
+            self.on_warning(f"Couldn't move {len(report.failed)} folder(s) back, "
+                            f"they are still in the Cleanup folder:\n" + report.summary())
+        elif not report.stopped:
+            if os.path.isdir(cleanup):
+                os.rmdir(cleanup)
+            journal.remove()
+        if report.stopped:
+            self.progress.stop()
+        else:
+            self.progress.finish("waiting for user action...")
+        return report
+
+    def cleanup_folders(self):
+        """Names of the beatmap folders in Cleanup, whether they are in there as a folder or as an archive."""
+        from archiver import folder_name
+        cleanup = os.path.join(self.path, "Cleanup")
+        entries = os.listdir(cleanup) if os.path.isdir(cleanup) else []
+        return list(dict.fromkeys(name for name in map(folder_name, entries) if name is not None))
+
+    @tracing.traced("delete cleanup")
+    def delete_cleanup(self, folders=None):
+        """
+        Deletes everything in Cleanup for good, or only the given entries of it.
+
+        Cancelling cancel_token stops it early, whatever wasn't deleted by then stays in Cleanup and
+        can still be reverted. Returns a deleter.DeleteReport.
+        """
+        from archiver import folder_name
+        from deleter import delete_folders, remove_folder
+        cleanup = os.path.join(self.path, "Cleanup")
+        staging = os.path.join(self.path, "Cleanup.deleting")
+        if folders is None:
+            folders = sorted(os.listdir(cleanup)) if os.path.isdir(cleanup) else []
+        self.progress.start(len(folders), "Deleting Cleanup folder")
+        if os.path.isdir(staging):
+            # left behind by a delete that got killed, none of it can be reverted anymore
+            for leftover in os.listdir(staging):
+                try:
+                    remove_folder(os.path.join(staging, leftover))
+                except OSError:
+                    pass
+        journal = Journal(self.path)
+        # the journal names folders the way work and revert do, an archive goes by the folder it holds
+        journal.begin("delete", [folder_name(entry) or entry for entry in folders])
+        try:
+            report = delete_folders(cleanup, staging, folders, self.report_delete,
+                                    lambda entry, ok: journal.record(folder_name(entry) or entry, ok),
+                                    stopped=self.cancel_token)
+            journal.end()
+        finally:
+            journal.close()
+        if report.failed:
+            self.on_warning(f"Couldn't delete {len(report.failed)} folder(s):\n" + report.summary())
+        if not report.stopped and not report.failed:
+            try:
+                if os.path.isdir(cleanup):
+                    os.rmdir(cleanup)
+                journal.remove()
+            except OSError:
+                pass  # something new got put in there meanwhile, keep it and the journal
+        self.progress.finish("waiting for user action...")
+        return report
+
+    def report_delete(self, done, folder, report):
+        self.progress.status(f"{report.bytes / 1024 ** 2:,.0f} MiB freed, deleted folder: {folder}")
+        self.progress.update(done)
+
+    def interrupted_run(self):
+        return Journal(self.path).replay()[1]
+
+    @tracing.traced("recover")
+    def recover(self, resume):
+        """Finishes (resume=True) or undoes the moves of a run that got interrupted, an interrupted delete can only be finished or left as is."""
+        run = self.interrupted_run()
+        if run is None:
+            return
+        if run.action == "delete":
+            if resume:
+                from archiver import archive_path
+                cleanup = os.path.join(self.path, "Cleanup")
+                entries = []
+                for folder in run.remaining:
+                    for path in (os.path.join(cleanup, folder), archive_path(cleanup, folder)):
+                        if os.path.lexists(path):
+                            entries.append(os.path.basename(path))
+                            break
+                # Engine's own, finishing a delete is part of the recovery and not a delete the GUI started
+                return Engine.delete_cleanup(self, entries)
+            # deleted folders can't be brought back, an empty run just marks this one as dealt with
+            journal = Journal(self.path)
+            journal.begin("delete", [])
+            journal.end()
+            return None
+        from archiver import archive_path, remove_partials
+        from deleter import remove_folder
+        songs = os.path.join(self.path, "Songs")
+        cleanup = os.path.join(self.path, "Cleanup")
+        remove_partials(cleanup)
+        done = []
+        remaining = []
+        for folder in run.planned:
+            in_songs = os.path.lexists(os.path.join(songs, folder))
+            archived = os.path.lexists(archive_path(cleanup, folder))
+            in_cleanup = archived or os.path.lexists(os.path.join(cleanup, folder))
+            if folder in run.done:
+                done.append(folder)
+            elif run.action == "archive" and archived:
+                # an archive only gets its name once it is verified, we got killed while removing the folder
+                if in_songs:
+                    remove_folder(os.path.join(songs, folder))
+                done.append(folder)
+            elif (in_songs and not in_cleanup) if run.action == "revert" else (in_cleanup and not in_songs):
+                done.append(folder)  # moved right before we got killed, the journal just didn't get to record it
+            else:
+                remaining.append(folder)
+
+        os.makedirs(cleanup, exist_ok=True)
+        if resume:
+            self.progress.start(len(remaining), "Resuming interrupted Cleanup")
+            report = self.move(run.action, remaining, already_moved=[f for f in done if f not in run.done])
+        else:
+            self.progress.start(len(done), "Rolling back interrupted Cleanup")
+            report = self.move("work" if run.action == "revert" else "revert", done)
+        if report.failed:
+            self.on_warning(f"Couldn't move {len(report.failed)} folder(s) while recovering:\n"
+                            + report.summary())
+        if report.stopped:
+            self.progress.stop()
+        else:
+            self.progress.finish("waiting for user action...")
+        return report
+
+    def move(self, action, folders, already_moved=()):
+        """
+        Moves folders from Songs to Cleanup ("work"), packs them into archives in Cleanup ("archive")
+        or brings them back whichever way they got there ("revert"), journaling every step.
+
+        already_moved are recorded as done without touching them. Once cancel_token gets cancelled the
+        run ends early, the journal then tells which folders made it.
+        """
+        from mover import move_folders
+        songs = os.path.join(self.path, "Songs")
+        cleanup = os.path.join(self.path, "Cleanup")
+        verb = {"work": "moving", "archive": "packing", "revert": "reverting"}[action]
+        journal = Journal(self.path)
+        journal.begin(action, [*already_moved, *folders])
+        try:
+            for folder in already_moved:
+                journal.record(folder, True)
+            with tracing.span("move", action=action, folders=len(folders)):
+                if action == "archive":
+                    from archiver import archive_path, pack_folder, run_jobs
+                    # journaled by the name the plan has, "Sub/Folder" for folders in a subfolder of Songs
+                    names = {os.path.join(songs, f): f for f in folders}
+                    jobs = [(src, archive_path(cleanup, f)) for src, f in names.items()]
+                    report = run_jobs(pack_folder, jobs,
+                                      lambda done, src: self.report_move(done, src, verb),
+                                      lambda src, ok: journal.record(names[src], ok),
+                                      stopped=self.cancel_token)
+                    tracing.count("bytes packed", report.size)
+                    tracing.count("archive bytes", report.packed)
+                else:
+                    src_dir, dst_dir = (songs, cleanup) if action == "work" else (cleanup, songs)
+                    archived = set()
+                    if action == "revert":
+                        from archiver import archive_path
+                        archived = {f for f in folders if not os.path.lexists(os.path.join(cleanup, f))
+                                    and os.path.lexists(archive_path(cleanup, f))}
+                    names = {os.path.join(src_dir, f): f for f in folders if f not in archived}
+                    moves = [(src, os.path.join(dst_dir, f)) for src, f in names.items()]
+                    report = move_folders(moves, lambda done, src: self.report_move(done, src, verb),
+                                          lambda src, ok: journal.record(names[src], ok),
+                                          stopped=self.cancel_token)
+                    if archived and not report.stopped:
+                        report = self.unpack(archived, report, journal)
+            journal.end()
+        finally:
+            journal.close()
+        if action == "revert":
+            for folder in folders:
+                self.remove_empty_parents(cleanup, folder)
+        tracing.count("folders moved", len(report.moved))
+        tracing.count("move errors", len(report.failed))
+        return report
+
+    def unpack(self, folders, report, journal):
+        """Unpacks the archives of folders from Cleanup into Songs as part of a revert, adds the outcome to report."""
+        from archiver import archive_path, folder_name, run_jobs, unpack_folder
+        songs = os.path.join(self.path, "Songs")
+        cleanup = os.path.join(self.path, "Cleanup")
+        moved = len(report.moved) + len(report.failed)
+        names = {archive_path(cleanup, f): f for f in sorted(folders)}
+        jobs = [(src, os.path.join(songs, f)) for src, f in names.items()]
+        unpacked = run_jobs(unpack_folder, jobs,
+                            lambda done, src: self.report_move(moved + done, folder_name(src), "unpacking"),
+                            lambda src, ok: journal.record(names[src], ok),
+                            stopped=self.cancel_token)
+        tracing.count("bytes unpacked", unpacked.size)
+        unpacked.moved[:0] = report.moved
+        unpacked.failed[:0] = report.failed
+        return unpacked
+
+    @staticmethod
+    def remove_empty_parents(root, folder):
+        """Removes the subfolders of root that held folder ("Sub" of "Sub/Folder") once they are empty."""
+        parent = os.path.dirname(os.path.join(root, folder))
+        while os.path.normpath(parent) != os.path.normpath(root):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                return  # not empty, or already gone
+            parent = os.path.dirname(parent)
+
+    def report_move(self, done, src, action):
+        self.progress.status(f"{action} folder: {os.path.basename(src)}")
+        self.progress.update(done)
+
+    @tracing.traced("filter")
+    def filter(self, filters, orphans=False, duplicates=False):
+        """
+        Picks the folders that none of filters keep.
+
+        orphans=True adds every folder osu!.db doesn't list, duplicates=True every folder that is a
+        copy of another one, whether the filters keep it or not.
+        """
+        assert filters
+        self.progress.start(0, "Filtering Beatmaps")
+        with self.lock:
+            total_amount = len(self.index) - len(self.missing)
+            self.filters = list(filters)
+            removable = self.index.removable(filters)
+            self.paths_to_delete = [folder for folder in removable if folder not in self.missing]
+            if orphans or duplicates:
+                known = set(self.index.directories)
+                extra = list(self.orphans) if orphans else []
+                if duplicates:
+                    copies = {folder: keeper for folder, keeper in self.duplicates.items()
+                              if folder not in self.missing and keeper not in self.missing}
+                    removable = set(removable)
+                    # whatever the filters keep in a copy has to stay in the folder it is a copy of
+                    spared = {keeper for folder, keeper in copies.items()
+                              if folder in known and folder not in removable}
+                    self.paths_to_delete = [folder for folder in self.paths_to_delete if folder not in spared]
+                    extra += [folder for folder in copies if folder not in removable]
+                extra = list(dict.fromkeys(extra))
+                total_amount += sum(folder not in known for folder in extra)
+                self.paths_to_delete += extra
+            remove_amount = len(self.paths_to_delete)
+        tracing.count("folders to remove", remove_amount)
+
+        self.progress.finish("waiting for user action...")
+        return total_amount, remove_amount
+
+    @tracing.traced("where")
+    def where(self, text):
+        """
+        Makes the beatmaps a query.py expression matches the "where" filter, an empty text drops it again.
+
+        Before the first scan this only tells analyze() which fields to decode. After it osu!.db gets parsed
+        again if the expression needs fields the last scan didn't decode. Raises query.QueryError if text
+        doesn't parse, returns False if cancel_token got cancelled.
+        """
+        from query import Query
+        self.query = Query(text) if text and text.strip() else None
+        with self.lock:
+            self.hashes.pop("where", None)
+            self.index.bitsets.pop("where", None)
+        if self.query is None or not self.hashes:
+            return True
+        if not self.query.fields <= self.beatmaps.fields.keys():
+            return self.scan(["osu!.db"], songs=False, quiet=True)  # take_over matches it
+        self.progress.status("Matching Beatmaps")
+        try:
+            self.match_query(self.beatmaps, self.hashes, self.index)
+        except Cancelled:
+            self.progress.stop()
+            return False
+        return True
+
+    def match_query(self, beatmaps, hashes, index):
+        """Adds the "where" filter to hashes and index, raises cancel.Cancelled once cancel_token gets cancelled."""
+        with tracing.span("match query", beatmaps=len(beatmaps)):
+            rows = self.query.rows(beatmaps, hashes, self.cancel_token)
+            index.add_rows("where", rows, self.cancel_token)
+            hashes["where"] = rows  # rows of the store, like played
+        tracing.count("beatmaps matched", len(rows))
+
+    @tracing.traced("plan")
+    def plan(self):
+        """
+        Measures the folders the last filter() picked without moving anything.
+
+        Returns a planner.Plan, with the size of every folder and for every filter how many of them
+        it would keep, or None if the thread got stopped.
+        """
+        from planner import plan_folders
+        from scancache import ScanCache
+        self.progress.start(len(self.paths_to_delete), "Measuring Beatmap folders")
+        cache = ScanCache()
+        try:
+            plan = plan_folders(os.path.join(self.path, "Songs"), self.paths_to_delete, cache,
+                                on_progress=self.progress.update, stopped=self.cancel_token)
+        finally:
+            cache.close()
+        if plan is None:
+            self.progress.stop()
+            return None
+        ids = self.index.removable_ids(self.filters)
+        for name in self.index.bitsets:
+            kept = [self.index.directories[i] for i in self.index.kept_ids(name, ids)
+                    if self.index.directories[i] in plan.sizes]
+            plan.by_filter[name] = len(kept), sum(plan.sizes[folder] for folder in kept)
+        tracing.count("bytes planned", plan.total_bytes)
+        tracing.count("folder sizes from cache", plan.cached)
+        self.progress.finish("waiting for user action...")
+        return plan
+
+    def collections_of(self, h):
+        """Names of the collections a beatmap hash is in."""
+        mask = self.collection_membership.get(h, 0)
+        return [name for i, name in enumerate(self.collection_names) if mask >> i & 1]
+
+    @tracing.traced("copy to tmp")
+    def copy_to_tmp(self, file):
+        src = os.path.join(self.path, file)
+        self.progress.start(os.path.getsize(src), f"Copying {file} to local tmp folder")
+        os.makedirs(os.path.abspath("tmp"), exist_ok=True)
+        dst = os.path.join(os.path.abspath("tmp"), file)
+        copied = 0
+        # in chunks rather than shutil.copyfile, a 400 MB osu!.db on a slow drive would hold up cancelling
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            while True:
+                self.cancel_token.check()
+                chunk = fsrc.read(COPY_CHUNK)
+                if not chunk:
+                    break
+                fdst.write(chunk)
+                copied += len(chunk)
+                self.progress.update(copied)
+        shutil.copystat(src, dst)
+        tracing.count("bytes copied", copied)
+        return dst
+
+    def plan_jobs(self, pending):
+        """
+        Yields (file, loader, args, size) for every job needed to parse the pending databases.
+
+        Large osu!.db files are split into shards that get decoded in parallel. Shards come last,
+        so the other databases are already being parsed while their offsets are searched.
+        """
+        import workers
+        for file, filename in pending.items():
+            if file != "osu!.db":
+                yield file, getattr(workers, LOADERS[file]), (filename,), os.path.getsize(filename)
+        if "osu!.db" in pending:
+            filename = pending["osu!.db"]
+            size = os.path.getsize(filename)
+            fields = self.query_fields()
+            for offset, count, share in SmallOsuDb.shards(filename, workers.MAX_PROCESSES, workers.SHARD_MIN_BEATMAPS,
+                                                          self.cancel_token):
+                yield "osu!.db", workers.load_beatmaps, (filename, offset, count, fields), size * share
+
+    def query_fields(self):
+        """Optional osu!.db fields the query needs, decoding all of them would slow down every scan."""
+        return tuple(sorted(self.query.fields)) if self.query is not None else ()
+
+    @tracing.traced("load databases")
+    def run_loaders(self, pending):
+        """
+        Parses the pending databases in a pool of worker processes.
+
+        Progress of all workers is merged into one bar, weighted by how many bytes each one covers.
+        Returns the result (or the raised exception) per file. Raises cancel.Cancelled once cancel_token
+        gets cancelled, the workers don't check it and get terminated instead.
+        """
+        import workers
+        self.progress.start(0, "Loading " + ", ".join(pending))
+        slots = len(pending) - 1 + workers.MAX_PROCESSES
+        pool, progress = workers.create_pool(max(len(pending), workers.MAX_PROCESSES), slots)
+        try:
+            tasks = []
+            weights = []
+            for slot, (file, loader, args, size) in enumerate(self.plan_jobs(pending)):
+                self.cancel_token.check()
+                tasks.append((file, pool.apply_async(loader, (slot, *args))))
+                weights.append(max(size, 1))
+            pool.close()
+            self.progress.start(1000)
+            while not all(task.ready() for _, task in tasks):
+                if self.cancel_token.wait(1 / 15):  # 15 fps update, but wakes up right away when cancelled
+                    raise Cancelled()
+                tracing.drain()
+                done = sum(weight * min(progress[2 * i] / progress[2 * i + 1], 1)
+                           for i, weight in enumerate(weights) if progress[2 * i + 1])
+                self.progress.update(1000 * done / sum(weights))
+
+            parts = {file: [] for file in pending}
+            for file, task in tasks:
+                try:
+                    parts[file].append(task.get())
+                except Exception as err:
+                    parts[file].append(err)
+            results = {}
+            for file, file_parts in parts.items():
+                errors = [part for part in file_parts if isinstance(part, Exception)]
+                if errors:
+                    results[file] = errors[0]
+                elif file == "osu!.db":
+                    results[file] = workers.merge_beatmaps(file_parts, self.cancel_token)
+                else:
+                    results[file] = file_parts[0]
+            return results
+        finally:
+            tracing.drain()
+            pool.terminate()
+            pool.join()
+
+    def load_databases(self, cache, files=LOADERS):
+        """
+        Returns the parsed result of the given databases, only parsing the ones that changed since the last scan.
+
+        Raises cancel.Cancelled once cancel_token gets cancelled.
+        """
+        keys = {}
+        results = {}
+        pending = {}
+        for file in files:
+            source = os.path.join(self.path, file)
+            with tracing.span("scan cache lookup", file=file):
+                keys[file] = cache.key(source)
+                results[file] = cache.get(source, keys[file])
+            if file == "osu!.db" and results[file] is not None:
+                if not set(self.query_fields()) <= results[file].fields.keys():
+                    results[file] = None  # cached before the query asked for fields it needs
+            tracing.count("scan cache misses" if results[file] is None else "scan cache hits")
+            if results[file] is None:
+                # in snapshot mode the original is read in place, nothing here ever opens it for writing
+                pending[file] = source if self.snapshot else self.copy_to_tmp(file)
+
+        while pending:
+            parsed = self.run_loaders(pending)
+            retry = {}
+            for file, result in parsed.items():
+                source = os.path.join(self.path, file)
+                if pending[file] == source and (isinstance(result, OSError) or file_signature(source) != keys[file][:2]):
+                    # osu! wrote to the file while we were reading it (or we couldn't open it), fall back to a copy
+                    retry[file] = self.copy_to_tmp(file)
+                elif isinstance(result, Exception):
+                    if file != "scores.db":
+                        raise result
+                    self.on_warning("Couldn't process Scores:\n" + "".join(traceback.TracebackException.from_exception(result).format()) + "\n If you think this isn't your fault, message InvisibleSymbol#2788 on Discord with this screenshot.")
+                    results[file] = {}, []
+                else:
+                    results[file] = result
+                    self.cancel_token.check()
+                    with tracing.span("scan cache store", file=file):
+                        cache.put(source, keys[file], result)
+            pending = retry
+        return results
+
+    @tracing.traced("list Songs")
+    def list_songs(self):
+        folders = list_folders(os.path.join(self.path, "Songs"), self.cancel_token)
+        tracing.count("folders in Songs", len(folders))
+        return folders
+
+    def check_songs(self, listing, quiet=False):
+        """Diffs the listing of Songs against osu!.db, see songs.py. quiet skips the warning about missing folders."""
+        try:
+            on_disk = listing.result()
+        except OSError as err:
+            self.on_warning(f"Couldn't list the Songs folder, orphaned and missing folders aren't detected:\n{err}")
+            return
+        with tracing.span("diff Songs", folders=len(on_disk)):
+            # folders whose every beatmap is in another folder too only show up as shadows of the store
+            listed = dict.fromkeys([*self.index.directories, *self.beatmaps.shadow_directories])
+            orphans, missing = diff_songs(os.path.join(self.path, "Songs"), on_disk, listed)
+        with self.lock:
+            self.orphans = orphans
+            self.missing = set(missing)
+        tracing.count("orphaned folders", len(orphans))
+        tracing.count("missing folders", len(missing))
+        if quiet:
+            return
+        # osu!.db keeps listing what a Cleanup moved until osu! rescans, they stay out of the Cleanup
+        # like every missing folder but aren't worth a warning
+        if missing and os.path.isdir(os.path.join(self.path, "Cleanup")):
+            moved = set(self.cleanup_folders())
+            missing = [folder for folder in missing if folder not in moved]
+        if missing:
+            self.on_warning(f"{len(missing)} Beatmap folder(s) listed in osu!.db are missing from Songs, "
+                            f"they are left out of the Cleanup:\n" + "\n".join(missing[:10])
+                            + ("\n..." if len(missing) > 10 else ""))
+
+    @tracing.traced("find duplicates")
+    def find_duplicates(self):
+        """Finds the folders that are copies of others, see duplicates.py."""
+        from duplicates import redundant_copies, redundant_folders
+        duplicates = redundant_folders(self.beatmaps)
+        if self.hash_files and self.orphans:
+            from scancache import ScanCache
+            self.progress.status("Comparing the files of unknown folders")
+            cache = ScanCache()
+            try:
+                copies = redundant_copies(os.path.join(self.path, "Songs"), self.orphans, self.beatmaps, cache,
+                                          stopped=self.cancel_token)
+            finally:
+                cache.close()
+            for folder, keeper in copies.items():
+                duplicates[folder] = duplicates.get(keeper, keeper)
+        self.duplicates = duplicates
+        tracing.count("duplicate folders", len(duplicates))
+
+    @tracing.traced("analyze")
+    def analyze(self):
+        return self.scan(list(LOADERS), songs=True)
+
+    @tracing.traced("refresh")
+    def refresh(self, changed):
+        """
+        Brings the scan up to date after a watcher.Watcher saw the given databases or "Songs" change.
+
+        Only the databases that changed get parsed again, the rest of the scan stays as it is.
+        """
+        return self.scan([file for file in LOADERS if file in changed], songs="Songs" in changed, quiet=True)
+
+    def scan(self, files, songs, quiet=False):
+        """
+        Parses the given databases and takes them over, relisting Songs if asked to or if osu!.db changed.
+
+        Returns False if cancel_token got cancelled, the scan can be left half taken over then.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from scancache import ScanCache
+        self.progress.start(0, "Checking scan cache")
+        cache = ScanCache()
+        try:
+            # Songs gets listed while the databases load, it's all system calls
+            with ThreadPoolExecutor(max_workers=1, thread_name_prefix="osu!cleaner Songs") as pool:
+                listing = pool.submit(self.list_songs) if songs or "osu!.db" in files else None
+                try:
+                    results = self.load_databases(cache, files)
+                finally:
+                    cache.close()
+
+            self.take_over(results)
+            if listing is not None:
+                self.check_songs(listing, quiet)
+                self.find_duplicates()
+        except Cancelled:
+            shutil.rmtree(os.path.abspath("tmp"), ignore_errors=True)
+            self.progress.stop()  # whoever cancelled us owns the status line now
+            return False
+
+        self.progress.status("Finished Scanning, deleting temporary files")
+        shutil.rmtree(os.path.abspath("tmp"), ignore_errors=True)
+        self.progress.finish("waiting for user action...")
+        return True
+
+    def take_over(self, results):
+        """
+        Swaps in freshly parsed databases, only rebuilding the filters that depend on them.
+
+        Raises cancel.Cancelled once cancel_token gets cancelled, nothing has been swapped in then.
+        """
+        if "scores.db" in results and results["scores.db"][1]:
+            errors = results["scores.db"][1]
+            self.on_warning(f"Couldn't process {len(errors)} Score record(s), "
+                            f"Beatmaps next to them might be missing from the Scores filter:\n"
+                            + "\n".join(errors[:10]) + "\n If you think this isn't your fault, "
+                            "message InvisibleSymbol#2788 on Discord with this screenshot.")
+        beatmaps = results.get("osu!.db", self.beatmaps)
+        hashes = dict(self.hashes)
+        if "collection.db" in results:
+            hashes["collections"] = results["collection.db"][1].keys()
+        if "scores.db" in results:
+            hashes["scores"] = results["scores.db"][0].keys()
+        if "osu!.db" in results:
+            hashes["played"] = beatmaps.played()  # rows of the store rather than hashes
+
+        self.progress.status("Indexing Beatmap folders")
+        with tracing.span("build index", beatmaps=len(beatmaps)):
+            index = DirectoryIndex(beatmaps)
+            if "osu!.db" not in results:
+                index.bitsets.update(self.index.bitsets)  # same rows, the other filters still hold
+            for name, file in (("collections", "collection.db"), ("scores", "scores.db")):
+                if file in results or "osu!.db" in results:
+                    index.add_filter(name, hashes[name], self.cancel_token)
+            if "osu!.db" in results:
+                index.add_rows("played", hashes["played"], self.cancel_token)
+            if self.query is not None:
+                self.match_query(beatmaps, hashes, index)  # depends on all three databases
+
+        with self.lock:
+            if "collection.db" in results:
+                self.collection_names, self.collection_membership = results["collection.db"]
+            if "scores.db" in results:
+                self.score_counts = results["scores.db"][0]
+            self.beatmaps = beatmaps
+            self.hashes = hashes
+            self.index = index
@@ -0,0 +1,111 @@
+"""
+Deletes the folders in Cleanup for good, on a pool of threads.
+
+Every folder is first renamed into a staging folder next to Cleanup and only then removed, so a delete
+that gets cancelled or killed never leaves half a beatmap folder in Cleanup for Engine.revert to move back.
+"""
+import os
+import shutil
+import stat
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from cancel import bounded_jobs
+from mover import summarize_failures
+from planner import folder_usage
+
+DELETE_WORKERS = 8
+
+
+class DeleteReport:
+    def __init__(self):
+        self.deleted = []  # folder names
+        self.failed = []  # (folder, error message)
+        self.bytes = 0
+        self.files = 0
+        self.stopped = False
+
+    def summary(self, limit=10):
+        return summarize_failures(self.failed, limit, name=str)
+
+
+def _make_writable(function, path, _):
+    # Windows refuses to delete read-only files, which some beatmap files are
+    os.chmod(path, stat.S_IWRITE)
+    function(path)
+
+
+def remove_folder(path):
+    """Deletes path and everything below it, returns (bytes freed, files deleted)."""
+    with tracing.span("delete folder", folder=os.path.basename(path)):
+        if os.path.islink(path) or not os.path.isdir(path):
+            size = os.lstat(path).st_size
+            os.remove(path)
+            return size, 1
+        usage = folder_usage(path)
+        if sys.version_info >= (3, 12):
+            shutil.rmtree(path, onexc=_make_writable)
+        else:
+            shutil.rmtree(path, onerror=_make_writable)
+    return usage
+
+
+def delete_folders(src_dir, staging, folders, on_progress=None, on_done=None, stopped=None, workers=DELETE_WORKERS):
+    """
+    Deletes every folder in src_dir and returns a DeleteReport.
+
+    At most `workers` folders are staged at a time, once stopped() turns true no new ones are, the ones
+    already staged still get deleted. on_done(folder, ok) is called once a folder left src_dir and
+    on_progress(done, folder, report) after it is gone, both from the calling thread.
+    """
+    report = DeleteReport()
+    os.makedirs(staging, exist_ok=True)
+    done = 0
+
+    def finished(folder, error=None):
+        nonlocal done
+        done += 1
+        if error is None:
+            report.deleted.append(folder)
+        else:
+            report.failed.append((folder, error))
+        if on_progress is not None:
+            on_progress(done, folder, report)
+
+    def stopping():
+        if stopped is not None and stopped():
+            report.stopped = True
+        return report.stopped
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="osu!cleaner delete") as pool:
+
+        def stage(folder):
+            try:
+                os.rename(os.path.join(src_dir, folder), os.path.join(staging, folder))
+            except OSError as err:
+                if on_done is not None:
+                    on_done(folder, False)
+                finished(folder, err.strerror or str(err))
+                return None
+            if on_done is not None:
+                on_done(folder, True)
+            return pool.submit(remove_folder, os.path.join(staging, folder))
+
+        for folder, job in bounded_jobs(stage, folders, workers, stopping):
+            try:
+                size, files = job.result()
+            except Exception as err:
+                finished(folder, str(err))
+                continue
+            report.bytes += size
+            report.files += files
+            finished(folder)
+
+    tracing.count("folders deleted", len(report.deleted))
+    tracing.count("bytes freed", report.bytes)
+    try:
+        os.rmdir(staging)
+    except OSError:
+        pass  # something in there couldn't be deleted, it's listed in report.failed
+    return report
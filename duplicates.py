@@ -0,0 +1,178 @@
+"""
+Finds beatmap folders that are copies of other folders.
+
+osu!.db lists the same difficulty once per folder it is in, BeatmapStore keeps one row per hash and
+remembers the other folders as shadows. A folder is redundant if another folder has every one of
+its beatmaps, of folders with the same beatmaps the one osu! resolves the most hashes to is kept.
+
+Folders osu!.db doesn't list at all can optionally be checked by their files: the MD5 of an .osu file
+is the hash osu! knows the difficulty by, audio and images are compared by MD5 too. File hashes are
+computed on a pool of threads (hashlib doesn't hold the GIL) and cached on size and mtime.
+"""
+import hashlib
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import tracing
+from cancel import Cancelled, bounded_jobs, checked
+
+HASH_WORKERS = 8
+MEDIA_EXTENSIONS = (".mp3", ".ogg", ".wav", ".jpg", ".jpeg", ".png")
+_CHUNK = 1024 * 1024
+
+
+def folder_rows(store):
+    """Rows per folder, for every folder that shares a beatmap with another one."""
+    contents = {}
+    for row, folder in zip(store.shadow_rows, store.shadow_directories):
+        contents.setdefault(folder, set()).add(row)
+    if not contents:
+        return contents
+    ids = {folder: i for i, folder in enumerate(store.directories)}
+    wanted = {store.directory_ids[row] for row in store.shadow_rows}
+    wanted.update(ids[folder] for folder in contents if folder in ids)
+    for row, i in enumerate(store.directory_ids):
+        if i in wanted:
+            contents.setdefault(store.directories[i], set()).add(row)
+    return contents
+
+
+def redundant_folders(store):
+    """Returns {redundant folder: folder that has all of its beatmaps} from osu!.db alone."""
+    contents = folder_rows(store)
+    holders = {}  # row -> folders that have it
+    for folder, rows in contents.items():
+        for row in rows:
+            holders.setdefault(row, set()).add(folder)
+    resolved = Counter(store.directories[store.directory_ids[row]] for row in holders)
+
+    def rank(folder):
+        return len(contents[folder]), resolved[folder], folder
+
+    redundant = {}
+    for folder, rows in contents.items():
+        supersets = set.intersection(*(holders[row] for row in rows))
+        supersets.discard(folder)
+        better = [other for other in supersets if rank(other) > rank(folder)]
+        if better:
+            # the best superset can't be redundant itself, anything above it would be above this one too
+            redundant[folder] = max(better, key=rank)
+    return redundant
+
+
+def file_md5(path):
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(_CHUNK)
+            if not chunk:
+                return md5.digest()
+            md5.update(chunk)
+
+
+def folder_files(path):
+    """(path, size, mtime) of the .osu files and of the audio and image files directly in path."""
+    osu_files = []
+    media = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            name = entry.name.lower()
+            if name.endswith(".osu"):
+                found = osu_files
+            elif name.endswith(MEDIA_EXTENSIONS):
+                found = media
+            else:
+                continue
+            try:
+                if entry.is_file():
+                    stat = entry.stat()
+                    found.append((entry.path, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                continue
+    return osu_files, media
+
+
+def hash_files(files, cache=None, workers=HASH_WORKERS, stopped=None):
+    """
+    Returns path -> MD5 digest of every (path, size, mtime), only reading files the cache doesn't know.
+
+    Raises cancel.Cancelled once stopped() turns true, what got hashed until then is still cached.
+    """
+    stats = {path: (size, mtime) for path, size, mtime in files}
+    digests = cache.get_file_hashes(stats) if cache is not None else {}
+    missing = [path for path in stats if path not in digests]
+    tracing.count("file hashes from cache", len(digests))
+    tracing.count("files hashed", len(missing))
+    hashed = []
+    try:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="osu!cleaner hash") as pool:
+            for path, job in bounded_jobs(lambda path: pool.submit(_try_md5, path), missing, 2 * workers, stopped):
+                digest = job.result()
+                if digest is not None:
+                    digests[path] = digest
+                    hashed.append((path, *stats[path], digest))
+        if stopped is not None and stopped():
+            raise Cancelled()
+    finally:
+        if cache is not None and hashed:
+            cache.put_file_hashes(hashed)
+    return digests
+
+
+def _try_md5(path):
+    try:
+        return file_md5(path)
+    except OSError:
+        return None
+
+
+def redundant_copies(songs, folders, store, cache=None, workers=HASH_WORKERS, stopped=None):
+    """
+    Returns {folder: folder osu!.db lists that has all of its files} for the given folders.
+
+    Every .osu file of a folder has to be a difficulty osu!.db has in one and the same other folder,
+    and every audio and image file has to be in that folder too. Folders without .osu files are skipped.
+    Raises cancel.Cancelled once stopped() turns true.
+    """
+    listings = {}
+    for folder in checked(folders, stopped, 16):
+        try:
+            listings[folder] = folder_files(os.path.join(songs, folder))
+        except OSError:
+            continue
+    osu_digests = hash_files([file for osu_files, _ in listings.values() for file in osu_files], cache, workers,
+                             stopped)
+
+    candidates = {}
+    for folder, (osu_files, _) in listings.items():
+        owners = set()
+        for path, _, _ in osu_files:
+            row = store.find(osu_digests[path]) if path in osu_digests else -1
+            if row < 0:
+                break
+            owners.add(store.directories[store.directory_ids[row]])
+        else:
+            if len(owners) == 1 and folder not in owners:
+                candidates[folder] = owners.pop()
+    if not candidates:
+        return {}
+
+    keepers = {}
+    for keeper in checked(set(candidates.values()), stopped, 16):
+        try:
+            keepers[keeper] = folder_files(os.path.join(songs, keeper))[1]
+        except OSError:
+            continue
+    media = [file for folder in candidates for file in listings[folder][1]]
+    media += [file for files in keepers.values() for file in files]
+    media_digests = hash_files(media, cache, workers, stopped)
+
+    copies = {}
+    for folder, keeper in candidates.items():
+        if keeper not in keepers:
+            continue
+        kept = {media_digests[path] for path, _, _ in keepers[keeper] if path in media_digests}
+        if all(media_digests.get(path) in kept for path, _, _ in listings[folder][1]):
+            copies[folder] = keeper
+    return copies
@@ -0,0 +1,62 @@
+from cancel import checked
+from store import BeatmapStore
+
+
+class DirectoryIndex:
+    """
+    Maps every filter to a bitset over the directory ids of a BeatmapStore.
+
+    Bitsets are plain ints, so any combination of filters is a single OR
+    and the directories to remove are the unset bits of the result.
+    """
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else BeatmapStore()
+        self.directories = self.store.directories  # id -> directory
+        self.bitsets = {}  # filter name -> bitset of directory ids it keeps
+
+    def __len__(self):
+        return len(self.directories)
+
+    def add_filter(self, name, hashes, stopped=None):
+        """Keeps the directories of the given hex hashes."""
+        self.add_rows(name, self.store.rows(hashes), stopped)
+
+    def add_rows(self, name, rows, stopped=None):
+        """Keeps the directories of the given store rows, raises cancel.Cancelled once stopped() turns true."""
+        bits = bytearray((len(self.directories) + 7) // 8)
+        directory_ids = self.store.directory_ids
+        for row in checked(rows, stopped):
+            i = directory_ids[row]
+            bits[i >> 3] |= 1 << (i & 7)
+        self.bitsets[name] = int.from_bytes(bits, "little")
+
+    def keep_mask(self, filters):
+        mask = 0
+        for name in filters:
+            mask |= self.bitsets[name]
+        return mask
+
+    def removable_ids(self, filters):
+        """Ids of the directories that none of the given filters keep, in order."""
+        size = len(self.directories)
+        data = self.keep_mask(filters).to_bytes((size + 7) // 8, "little")
+        result = []
+        for byte_index, byte in enumerate(data):
+            if byte == 0xff:
+                continue
+            base = byte_index << 3
+            for bit in range(min(8, size - base)):
+                if not byte >> bit & 1:
+                    result.append(base + bit)
+        return result
+
+    def removable(self, filters):
+        """Directories that none of the given filters keep, in id order."""
+        directories = self.directories
+        return [directories[i] for i in self.removable_ids(filters)]
+
+    def kept_ids(self, name, ids):
+        """The ids out of ids that the given filter keeps."""
+        data = self.bitsets[name].to_bytes((len(self.directories) + 7) // 8, "little")
+        return [i for i in ids if data[i >> 3] >> (i & 7) & 1]
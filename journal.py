@@ -0,0 +1,107 @@
+import json
+import os
+
+SYNC_EVERY = 256  # completed moves between two fsyncs
+
+
+class JournalRun:
+    def __init__(self, action):
+        # "work" moves Songs -> Cleanup, "archive" packs Songs into .osz archives in Cleanup,
+        # "revert" moves or unpacks Cleanup -> Songs, "delete" empties Cleanup
+        self.action = action
+        self.planned = []
+        self.done = set()
+
+    @property
+    def remaining(self):
+        return [folder for folder in self.planned if folder not in self.done]
+
+
+class Journal:
+    """
+    Append-only log of every move between Songs and Cleanup, kept next to the Cleanup folder.
+
+    Each line is a small JSON list: ["begin", action], ["plan", folder], ["done", folder],
+    ["fail", folder] or ["end"]. A run without an "end" was interrupted and can be resumed
+    or rolled back, and replaying all "done" entries tells which folders are in Cleanup
+    without listing it.
+    """
+
+    def __init__(self, path):
+        self.filename = os.path.join(path, "Cleanup.journal")
+        self.file = None
+        self.unsynced = 0
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def replay(self):
+        """Returns the folders that are in Cleanup and the interrupted run, if there is one."""
+        in_cleanup = {}  # used as an ordered set
+        run = None
+        try:
+            with open(self.filename, encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return [], None
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # the last line can be cut off if we got killed while writing it
+            op = entry[0]
+            if op == "begin":
+                run = JournalRun(entry[1])
+            elif run is None:
+                continue
+            elif op == "plan":
+                run.planned.append(entry[1])
+            elif op == "done":
+                run.done.add(entry[1])
+                if run.action in ("work", "archive"):
+                    in_cleanup[entry[1]] = None
+                else:
+                    in_cleanup.pop(entry[1], None)
+            elif op == "end":
+                run = None
+        return list(in_cleanup), run
+
+    def _write(self, *entry):
+        self.file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def begin(self, action, folders):
+        self.file = open(self.filename, "a", encoding="utf-8")
+        self._write("begin", action)
+        for folder in folders:
+            self._write("plan", folder)
+        self._sync()
+
+    def record(self, folder, ok):
+        self._write("done" if ok else "fail", folder)
+        self.unsynced += 1
+        if self.unsynced >= SYNC_EVERY:
+            self._sync()
+
+    def end(self):
+        self._write("end")
+        self._sync()
+        self.file.close()
+        self.file = None
+
+    def close(self):
+        """Closes the journal without ending the run, so it shows up as interrupted."""
+        if self.file is not None:
+            self._sync()
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        try:
+            os.remove(self.filename)
+        except FileNotFoundError:
+            pass
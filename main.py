@@ -1,22 +1,21 @@
 import os
 import shutil
+import sys
 import threading
-import time
 
-import humanize
-from PyQt5.QtCore import Qt, pyqtSignal
+from PyQt5.QtCore import Qt, pyqtSignal, QTimer
 from PyQt5.QtGui import QIcon
 from PyQt5.QtWidgets import (QLabel, QFrame, QPushButton, QMessageBox,
                              QVBoxLayout, QApplication, QMainWindow,
-                             QLineEdit, QSizePolicy, QProgressBar)
-from PyQt5.QtWinExtras import QWinTaskbarButton
+                             QLineEdit, QSizePolicy, QProgressBar, QCheckBox)
 
+import tracing
 import utils
-from objects import FolderButton, MultiWidget, Logic, Filter, BottomWidget
+from objects import FolderButton, MultiWidget, Logic, Filter, QueryFilter, BottomWidget
 from theme import load_theme
 
 WINDOW_HEIGHT = 727
-WINDOW_WIDTH = 420 + 48
+WINDOW_WIDTH = 420 + 48 + 3 * 37  # plus the rows of "What else to move"
 
 
 class WindowWrapper(QMainWindow):
@@ -29,11 +28,17 @@ class WindowWrapper(QMainWindow):
         self.setCentralWidget(self.main_window)
         self.setFixedWidth(WINDOW_HEIGHT)
         self.setFixedHeight(WINDOW_WIDTH)
-        self.taskbar_button = QWinTaskbarButton()
-        self.taskbar_progress = self.taskbar_button.progress()
+        # created on first show, the taskbar progress only exists on Windows
+        self.taskbar_button = None
+        self.taskbar_progress = None
 
     def showEvent(self, evt):
-        self.taskbar_button.setWindow(self.windowHandle())
+        if self.taskbar_button is None and sys.platform == "win32":
+            from PyQt5.QtWinExtras import QWinTaskbarButton
+            self.taskbar_button = QWinTaskbarButton()
+            self.taskbar_progress = self.taskbar_button.progress()
+        if self.taskbar_button is not None:
+            self.taskbar_button.setWindow(self.windowHandle())
 
     def closeEvent(self, event):
         if self.main_window.thread.is_alive():
@@ -47,9 +52,13 @@ class WindowWrapper(QMainWindow):
                 event.ignore()
 
     def update_progress(self, value):
-        self.taskbar_progress.setValue(value)
+        if self.taskbar_progress is None:
+            return
+        self.taskbar_progress.setValue(int(value))
 
     def init_progress(self, max_value):
+        if self.taskbar_progress is None:
+            return
         self.taskbar_progress.reset()
         if max_value == -1:
             self.taskbar_progress.hide()
@@ -59,7 +68,7 @@ class WindowWrapper(QMainWindow):
             self.taskbar_progress.setMinimum(0)
             self.taskbar_progress.setMaximum(0)
         else:
-            self.taskbar_progress.setRange(0, max_value)
+            self.taskbar_progress.setRange(0, int(max_value))
 
 
 class MainWindow(QFrame):
@@ -82,7 +91,7 @@ class MainWindow(QFrame):
             '<p align="center"><b>This is a really simple program that gives you the ability to quickly clean up your beatmap'
             ' folder.</b></p><p><hr><ul><li>'
             '<li>This will require you to do a rescan the next time you open osu!.<br>'
-            '<li>To be safe the code doesn\'t directly touch any of osu!\'s databases and instead creates local copies.<br>'
+            '<li>To be safe the code only ever opens osu!\'s databases read-only, and falls back to local copies if osu! writes to them mid-scan.<br>'
             '<li>This doesn\'t delete the files itself either, it only moves them to a different folder called'
             ' "Cleanup" inside your osu! folder.'
             ' This is to prevent unintentionally deleting important maps.<hr><p align="center">'
@@ -96,6 +105,17 @@ class MainWindow(QFrame):
         self.filter_scores = Filter("Beatmaps that have local Scores", "scores")
         self.filter_played = Filter("Beatmaps that have been played at least once locally", "played")
         self.filters = [self.filter_collections, self.filter_scores, self.filter_played]
+        self.filter_query = QueryFilter("Beatmaps matching", "where",
+                                        "mode == mania or (last_played < 2y and not in_collection)")
+        self.filter_query.setToolTip(
+            "Fields: mode (osu, taiko, ctb, mania), status (ranked, approved, qualified, loved, graveyard, ...), "
+            "stars, ar, cs, hp, od, drain_time, total_time, beatmap_id, mapset_id, last_played, last_edit, "
+            "in_collection, has_scores, played.\n"
+            "Combine them with and, or, not and parentheses. last_played < 2y means played within the last two years.")
+        self.header_extra = QLabel("What else to move:")
+        self.header_extra.setContentsMargins(10, 10, 10, 0)
+        self.filter_orphans = Filter("Folders in Songs that osu! doesn't know about", "orphans", "Folders", False)
+        self.filter_duplicates = Filter("Copies of Beatmaps that are in another folder too", "duplicates", "Folders", False)
 
         self.input_field = QLineEdit()
         self.input_field.setDisabled(True)
@@ -107,6 +127,10 @@ class MainWindow(QFrame):
         self.run_button.setDisabled(True)
         self.run_button.clicked.connect(self.ask_before_filter)
 
+        self.archive_toggle = QCheckBox("Pack as .osz")
+        self.archive_toggle.setToolTip("Pack every Beatmap folder into an .osz archive in the Cleanup folder, "
+                                       "so it takes up less space until you delete it. Reverting unpacks them again.")
+
         self.revert_button = QPushButton("Revert Cleanup")
         self.revert_button.setDisabled(True)
         self.revert_button.clicked.connect(self.revert_cleanup)
@@ -120,7 +144,14 @@ class MainWindow(QFrame):
         self.delete_cleanup_button.setDisabled(True)
         self.delete_cleanup_button.clicked.connect(self.ask_before_deleting)
 
-        self.container = MultiWidget(self.input_field, self.folder_button)
+        self.watch_toggle = QCheckBox("Watch")
+        self.watch_toggle.setToolTip("Keep the counts up to date while osu! changes its databases or the Songs folder.")
+        self.watch_toggle.stateChanged.connect(self.toggle_watching)
+        self.watcher = None
+        self.pending_changes = set()
+        self.refresh_disabled = []  # buttons a refresh disabled, they get enabled again once it's done
+
+        self.container = MultiWidget(self.input_field, self.folder_button, self.watch_toggle)
 
         self.progressbar = QProgressBar()
         self.progressbar.setFixedWidth(222 + 10)
@@ -140,8 +171,11 @@ class MainWindow(QFrame):
         self.layout.addWidget(self.filter_collections)
         self.layout.addWidget(self.filter_scores)
         self.layout.addWidget(self.filter_played)
-        self.layout.addWidget(self.filter_unsubmitted)
-        self.layout.addWidget(self.run_button)
+        self.layout.addWidget(self.filter_query)
+        self.layout.addWidget(self.header_extra)
+        self.layout.addWidget(self.filter_orphans)
+        self.layout.addWidget(self.filter_duplicates)
+        self.layout.addWidget(MultiWidget(self.run_button, self.archive_toggle))
         self.layout.addWidget(MultiWidget(self.revert_button, self.open_folder_button, self.delete_cleanup_button))
         self.layout.addWidget(BottomWidget(self.progressbar, self.status_text, self.sellout_text))
         self.layout.setContentsMargins(10, 10, 10, 10)
@@ -156,7 +190,22 @@ class MainWindow(QFrame):
         self.logic.show_warning_signal.connect(self.show_warning)
         self.logic.filter_finish_signal.connect(self.return_from_filter)
         self.logic.work_finish_signal.connect(self.announce_finish)
-
+        self.logic.delete_finish_signal.connect(self.return_from_delete)
+        self.logic.refresh_finish_signal.connect(self.update_counts)
+        self.logic.changed_signal.connect(self.queue_refresh)
+
+        self.painted = False
+        self.deleting = False
+        self.run_was_enabled = False
+
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.painted:
+            self.painted = True
+            # only go looking for osu! and start scanning once the window is on screen
+            QTimer.singleShot(0, self.detect_osu_path)
+
+    def detect_osu_path(self):
         tmp = utils.get_osu_path()
         if tmp:
             self.validate_path(tmp)
@@ -168,12 +217,16 @@ class MainWindow(QFrame):
             self.progressbar.reset()
             return
         self.progressbar.setValue(0)
-        self.progressbar.setRange(0, max_value)
+        self.progressbar.setRange(0, int(max_value))
 
     def open_cleanup_folder(self):
         os.startfile(os.path.join(self.logic.path, "Cleanup"))
 
     def ask_before_deleting(self):
+        if self.deleting:
+            return self.stop_deleting()
+        if self.busy():
+            return
         qm = QMessageBox()
         qm.setIcon(QMessageBox.Warning)
         qm.setWindowTitle("Are you sure about this?")
@@ -183,9 +236,35 @@ class MainWindow(QFrame):
         qm.setDefaultButton(QMessageBox.No)
         answer = qm.exec_()
         if answer == qm.Yes:
-            shutil.rmtree(os.path.join(self.logic.path, "Cleanup"))
-            self.delete_cleanup_button.setDisabled(True)
-            self.open_folder_button.setDisabled(True)
+            self.deleting = True
+            self.run_was_enabled = self.run_button.isEnabled()
+            for button in (self.run_button, self.folder_button, self.revert_button, self.open_folder_button):
+                button.setDisabled(True)
+            self.delete_cleanup_button.setText("Stop Deleting")
+            self.logic.cancel_token.reset()
+            self.thread = threading.Thread(target=self.logic.delete_cleanup,
+                                           name="osu!cleaner delete thread")
+            self.thread.daemon = True
+            self.thread.start()
+
+    def stop_deleting(self):
+        # whatever is still in Cleanup once the folders being deleted right now are gone stays revertable
+        self.logic.cancel_token.cancel()
+        self.delete_cleanup_button.setDisabled(True)
+        self.delete_cleanup_button.setText("Stopping...")
+
+    def return_from_delete(self):
+        if not self.deleting:
+            return  # not a delete ask_before_deleting started
+        self.logic.cancel_token.reset()  # Stop Deleting was only meant for this delete
+        self.deleting = False
+        self.delete_cleanup_button.setText("Delete Cleanup Folder")
+        left = os.path.exists(os.path.join(self.logic.path, "Cleanup"))
+        self.delete_cleanup_button.setEnabled(left)
+        self.open_folder_button.setEnabled(left)
+        self.revert_button.setEnabled(left and self.run_was_enabled)
+        self.run_button.setEnabled(self.run_was_enabled)
+        self.folder_button.setEnabled(True)
 
     def show_warning(self, message):
         qm = QMessageBox()
@@ -197,7 +276,7 @@ class MainWindow(QFrame):
         return qm.exec_()
 
     def update_progress(self, value):
-        self.progressbar.setValue(value)
+        self.progressbar.setValue(int(value))
         self.taskbar_update_progress.emit(value)
 
     def update_status(self, string):
@@ -220,15 +299,86 @@ class MainWindow(QFrame):
         return qm.exec_()
 
     def post_process(self):
-        for f in self.filters:
-            cnt = len(self.logic.hashes[f.filter_name])
-            f.update_hash_count(humanize.intcomma(cnt))
+        self.update_counts()
         self.run_button.setEnabled(True)
         if os.path.exists(os.path.join(self.logic.path, "Cleanup")):
             self.revert_button.setEnabled(True)
+        self.toggle_watching()
+
+    def update_counts(self):
+        import humanize
+        for f in self.filters:
+            cnt = len(self.logic.hashes[f.filter_name])
+            f.update_hash_count(humanize.intcomma(cnt))
+        if "where" in self.logic.hashes:
+            self.filter_query.update_hash_count(humanize.intcomma(len(self.logic.hashes["where"])))
+        self.filter_orphans.update_hash_count(humanize.intcomma(len(self.logic.orphans)))
+        self.filter_duplicates.update_hash_count(humanize.intcomma(len(self.logic.duplicates)))
+
+    def toggle_watching(self):
+        from watcher import Watcher
+        if self.watch_toggle.checkState() == 2 and self.logic.hashes and self.watcher is None:
+            self.watcher = Watcher(self.logic.path, self.logic.changed_signal.emit).start()
+        elif self.watch_toggle.checkState() != 2:
+            self.stop_watching()
+
+    def stop_watching(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+        self.pending_changes = set()
+
+    def queue_refresh(self, changed):
+        self.pending_changes |= changed
+        self.refresh_when_idle()
+
+    def refresh_when_idle(self):
+        if not self.pending_changes or self.watcher is None:
+            return
+        if self.thread.is_alive() or self.deleting:
+            # whatever runs now finishes first, Cleanups and reverts change Songs themselves
+            QTimer.singleShot(1000, self.refresh_when_idle)
+            return
+        changed, self.pending_changes = self.pending_changes, set()
+        # nothing else may start on top of it, it would share the progress and the cancel token
+        self.refresh_disabled = [button for button in (self.run_button, self.revert_button, self.delete_cleanup_button)
+                                 if button.isEnabled()]
+        for button in self.refresh_disabled:
+            button.setDisabled(True)
+        self.thread = threading.Thread(target=self.logic.refresh, args=(changed,),
+                                       name="osu!cleaner refresh thread")
+        self.thread.daemon = True
+        self.thread.start()
+        QTimer.singleShot(1000 // 60, self.return_from_refresh)
+
+    def return_from_refresh(self):
+        # polled instead of waiting for refresh_finish_signal, a cancelled refresh doesn't send it
+        if self.thread.is_alive():
+            QTimer.singleShot(1000 // 60, self.return_from_refresh)
+            return
+        for button in self.refresh_disabled:
+            button.setEnabled(True)
+        self.refresh_disabled = []
+
+    def busy(self):
+        """True if something still runs on self.thread, a click that came in right before its button got disabled."""
+        if self.thread.is_alive():
+            self.update_status("Still busy, try again in a moment...")
+            return True
+        return False
 
     def ask_before_filter(self):
+        from query import Query, QueryError
+        if self.busy():
+            return
         selected_filters = [f.filter_name for f in self.filters if f.toggle.checkState() == 2]
+        where = self.filter_query.text()
+        if where:
+            try:
+                Query(where)
+            except QueryError as err:
+                return self.show_warning(f"Couldn't read the expression:\n{where}\n\n{err}")
+            selected_filters.append(self.filter_query.filter_name)
 
         # lets be safe...
         if not selected_filters:
@@ -243,13 +393,17 @@ class MainWindow(QFrame):
 
         self.run_button.setDisabled(True)
         self.folder_button.setDisabled(True)
-        self.thread = threading.Thread(target=self.logic.filter,
+        self.logic.archive = self.archive_toggle.checkState() == 2
+        self.thread = threading.Thread(target=self.where_then_filter,
                                        name="osu!cleaner filter thread",
-                                       args=(selected_filters,))
+                                       args=(where, selected_filters, self.filter_orphans.toggle.checkState() == 2,
+                                             self.filter_duplicates.toggle.checkState() == 2))
         self.thread.daemon = True
         self.thread.start()
 
     def revert_cleanup(self):
+        if self.busy():
+            return
         self.thread = threading.Thread(target=self.logic.revert,
                                        name="osu!cleaner revert thread")
         self.thread.daemon = True
@@ -259,13 +413,24 @@ class MainWindow(QFrame):
         self.delete_cleanup_button.setDisabled(True)
 
     def return_from_filter(self, total_count, remove_amount):
+        import humanize
+        plan = self.logic.last_plan
         qm = QMessageBox()
         qm.setIcon(QMessageBox.Warning)
         qm.setWindowTitle("Are you sure about this?")
-        qm.setText(f"This will move {remove_amount} Beatmaps, "
+        verb = "pack" if self.logic.archive else "move"
+        qm.setText(f"This will {verb} {remove_amount} Beatmaps ({humanize.naturalsize(plan.total_bytes, binary=True)}), "
                    f"which will result in a new total of {total_count - remove_amount} Beatmaps!")
         qm.setInformativeText("Please note that this doesn\'t delete the files itself. "
                               "It is your job to click the delete button after you have confirmed that no important maps are missing.")
+        details = ["Largest folders:"]
+        details += [f"{humanize.naturalsize(size, binary=True):>10}  {folder}" for folder, size in plan.largest()]
+        others = [(name, folders, size) for name, (folders, size) in plan.by_filter.items() if folders]
+        if others:
+            details += ["", "Would be kept if you also enabled:"]
+            details += [f"{name}: {folders} Beatmaps, {humanize.naturalsize(size, binary=True)}"
+                        for name, folders, size in others]
+        qm.setDetailedText("\n".join(details))
         qm.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
         qm.setDefaultButton(QMessageBox.No)
         answer = qm.exec_()
@@ -279,30 +444,73 @@ class MainWindow(QFrame):
             self.folder_button.setEnabled(True)
 
     def validate_path(self, path):
+        self.refresh_disabled = []  # the new path decides which buttons make sense
         if os.path.exists(os.path.join(path, "Cleanup")):
             self.delete_cleanup_button.setEnabled(True)
             self.open_folder_button.setEnabled(True)
         self.folder_button.setDisabled(True)
         self.run_button.setDisabled(True)
-        self.logic.stop_thread = True
-        while self.thread.is_alive():
-            self.update_status("Killing Logic Thread...")
-            time.sleep(1 / 15)  # 15fps
-            QApplication.processEvents()
+        if self.thread.is_alive():
+            # every phase checks the token within about 100ms, check back instead of blocking the event loop
+            self.logic.cancel_token.cancel()
+            self.update_status("Stopping Logic Thread...")
+            QTimer.singleShot(1000 // 60, lambda: self.validate_path(path))
+            return
         self.clean_up()
         self.input_field.setText(str(path))
         files = ["osu!.exe", "osu!.db", "collection.db", "scores.db", "Songs"]
         if all(os.path.exists(os.path.join(path, file)) for file in files):
             self.update_status("Path looks fine, starting scan...")
             self.logic.path = path
+            run = self.logic.interrupted_run()
+            if run is not None:
+                resume = self.ask_about_interrupted_run(run)
+                if resume is not None:
+                    self.thread = threading.Thread(target=self.recover_then_analyze, args=(resume,),
+                                                   name="osu!cleaner recover thread")
+                    self.thread.daemon = True
             self.thread.start()
         else:
             self.update_status("Path seems to be incorrect")
         self.folder_button.setDisabled(False)
 
+    def ask_about_interrupted_run(self, run):
+        """Returns True to resume the run, False to roll it back and None to leave it for later."""
+        what = {"work": "moving Beatmaps to", "archive": "packing Beatmaps into", "revert": "moving Beatmaps back from",
+                "delete": "deleting Beatmaps in"}[run.action]
+        qm = QMessageBox()
+        qm.setIcon(QMessageBox.Warning)
+        qm.setWindowTitle("Unfinished Cleanup")
+        qm.setText(f"Seems like osu!cleaner got closed while {what} the Cleanup folder.")
+        if run.action == "delete":
+            qm.setInformativeText(f"{len(run.done)} of {len(run.planned)} folders were deleted. "
+                                  "You can delete the rest too, or keep them in the Cleanup folder.")
+        else:
+            qm.setInformativeText(f"{len(run.done)} of {len(run.planned)} folders were moved. "
+                                  "You can finish what was started, or move those folders back to where they were.")
+        resume = qm.addButton("Finish it", QMessageBox.AcceptRole)
+        rollback = qm.addButton("Keep the rest" if run.action == "delete" else "Undo it", QMessageBox.DestructiveRole)
+        qm.addButton("Later", QMessageBox.RejectRole)
+        qm.exec_()
+        if qm.clickedButton() == resume:
+            return True
+        if qm.clickedButton() == rollback:
+            return False
+        return None
+
+    def where_then_filter(self, where, filters, orphans, duplicates):
+        # matching can mean parsing osu!.db again for fields the last scan didn't decode
+        if self.logic.where(where):
+            self.logic.filter(filters, orphans, duplicates)
+
+    def recover_then_analyze(self, resume):
+        self.logic.recover(resume)
+        self.logic.analyze()
+
     def clean_up(self):
+        self.stop_watching()
         self.init_progress(-1)
-        for f in self.filters:
+        for f in [*self.filters, self.filter_query, self.filter_orphans, self.filter_duplicates]:
             f.update_hash_count("???")
         self.logic.reset()
         self.thread = threading.Thread(target=self.logic.analyze, name="osu!cleaner analyze thread")
@@ -314,6 +522,11 @@ class MainWindow(QFrame):
 
 
 if __name__ == "__main__":
+    import multiprocessing
+
+    # scans parse the databases in worker processes, which need this in the frozen exe
+    multiprocessing.freeze_support()
+    tracing.enable_from_env()  # OSU_CLEANER_TRACE=trace.json writes a trace of the session on exit
     # app setup
     app = QApplication([])
     app.setStyle("Fusion")
@@ -0,0 +1,111 @@
+import errno
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import tracing
+from cancel import Cancelled
+
+COPY_WORKERS = 8  # parallel copy jobs when source and destination are on different drives
+
+
+class MoveReport:
+    def __init__(self):
+        self.moved = []  # (src, dst)
+        self.failed = []  # (src, error message)
+        self.stopped = False  # whatever isn't in moved or failed then is still where it was
+
+    def summary(self, limit=10):
+        return summarize_failures(self.failed, limit)
+
+
+def summarize_failures(failed, limit=10, name=os.path.basename):
+    """One line per (path, error message) of failed, at most limit of them. name turns a path into what gets shown."""
+    lines = [f"{name(path)}: {error}" for path, error in failed[:limit]]
+    if len(failed) > limit:
+        lines.append(f"... and {len(failed) - limit} more")
+    return "\n".join(lines)
+
+
+def _copy_move(src, dst, stopped=None):
+    """
+    Fallback for moves across drives: copy the folder, then remove the original.
+
+    Raises cancel.Cancelled before copying the next file once stopped() turns true, src stays as it is.
+    """
+
+    def copy_file(file_src, file_dst):
+        if stopped is not None and stopped():
+            raise Cancelled()
+        return shutil.copy2(file_src, file_dst)
+
+    if stopped is not None and stopped():
+        raise Cancelled()
+    if os.path.lexists(dst):
+        raise FileExistsError(errno.EEXIST, "Destination already exists", dst)
+    with tracing.span("copy folder", folder=os.path.basename(src)):
+        try:
+            shutil.copytree(src, dst, copy_function=copy_file)
+        except BaseException:
+            shutil.rmtree(dst, ignore_errors=True)  # don't leave half a copy behind
+            raise
+        shutil.rmtree(src)
+
+
+def move_folders(moves, on_progress=None, on_done=None, stopped=None, workers=COPY_WORKERS):
+    """
+    Moves every (src, dst) folder pair and returns a MoveReport.
+
+    Each folder is renamed first, which is atomic and instant on the same drive. Folders that have to
+    cross drives are copied and removed by a pool of worker threads instead.
+    on_progress(done, src) and on_done(src, ok) get called after every single folder from the calling
+    thread, so they should be cheap, see progress.Reporter.
+    Once stopped() turns true no further folder is started and copies still running are rolled back.
+    """
+    moves = list(moves)
+    report = MoveReport()
+    done = 0
+
+    def progress(src, ok):
+        nonlocal done
+        done += 1
+        if on_done is not None:
+            on_done(src, ok)
+        if on_progress is not None:
+            on_progress(done, src)
+
+    copies = []
+    for src, dst in moves:
+        if stopped is not None and stopped():
+            report.stopped = True
+            break
+        try:
+            # a beatmap folder can sit in a subfolder of Songs ("Sub/Folder"), which has to exist on the other side too
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.rename(src, dst)
+            report.moved.append((src, dst))
+            progress(src, True)
+        except OSError as err:
+            if err.errno == errno.EXDEV:
+                copies.append((src, dst))
+                continue
+            report.failed.append((src, err.strerror or str(err)))
+            progress(src, False)
+
+    tracing.count("folders renamed", len(report.moved))
+    if copies:
+        tracing.count("folders copied across drives", len(copies))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="osu!cleaner move") as pool:
+            jobs = {pool.submit(_copy_move, src, dst, stopped): (src, dst) for src, dst in copies}
+            for job in as_completed(jobs):
+                src, dst = jobs[job]
+                try:
+                    job.result()
+                    report.moved.append((src, dst))
+                    progress(src, True)
+                except Cancelled:
+                    report.stopped = True
+                except Exception as err:
+                    report.failed.append((src, str(err)))
+                    progress(src, False)
+    return report
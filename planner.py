@@ -0,0 +1,120 @@
+"""
+Dry run of a Cleanup: how much disk space the folders picked by Engine.filter take up.
+
+Folders are walked with os.scandir on a pool of threads, the walk is almost all system calls which
+don't hold the GIL. Sizes are cached per folder and keyed on its mtime, which changes whenever a file
+is added to or removed from it, so planning again after a scan only walks what changed.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from cancel import Cancelled, bounded_jobs, checked
+
+SIZE_WORKERS = 16
+CACHE_BATCH = 4096  # folder sizes stored per transaction, about 20 ms each
+
+
+def folder_usage(path, stopped=None):
+    """
+    Returns (bytes on disk, file count) of everything below path, symlinks are not followed.
+
+    Once stopped() turns true the walk ends early and the result only covers what it got to.
+    """
+    size = 0
+    files = 0
+    stack = [path]
+    while stack and not (stopped is not None and stopped()):
+        try:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                            continue
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue  # vanished or unreadable, it won't take up space in Cleanup either
+                    # st_blocks is what the file really occupies, Windows doesn't have it
+                    size += stat.st_blocks * 512 if hasattr(stat, "st_blocks") else stat.st_size
+                    files += 1
+        except OSError:
+            continue
+    return size, files
+
+
+def folder_mtimes(songs, folders, stopped=None):
+    """
+    mtime of every folder in songs that exists, from a single listing of songs.
+
+    On Windows the listing already carries the mtimes, elsewhere it's a cheap stat per wanted folder.
+    """
+    wanted = set(folders)
+    mtimes = {}
+    with os.scandir(songs) as entries:
+        for entry in checked(entries, stopped, 256):
+            if entry.name in wanted:
+                try:
+                    mtimes[entry.name] = entry.stat(follow_symlinks=False).st_mtime_ns
+                except OSError:
+                    pass
+    return mtimes
+
+
+class Plan:
+    """Sizes of the folders a Cleanup would move, nothing has been moved to get them."""
+
+    def __init__(self, sizes, files, cached):
+        self.sizes = sizes  # folder -> bytes
+        self.files = files
+        self.cached = cached  # folders whose size came from the cache
+        self.by_filter = {}  # filter name -> (folders, bytes) of the planned folders it would keep
+
+    @property
+    def total_bytes(self):
+        return sum(self.sizes.values())
+
+    def largest(self, count=10):
+        return sorted(self.sizes.items(), key=lambda item: -item[1])[:count]
+
+
+def plan_folders(songs, folders, cache=None, workers=SIZE_WORKERS, on_progress=None, stopped=None):
+    """
+    Measures every folder in songs and returns a Plan, or None if stopped() turned true.
+
+    cache is a scancache.ScanCache, on_progress(done) gets called from the calling thread.
+    """
+    prefix = os.path.join(songs, "")
+    paths = {folder: prefix + folder for folder in folders}
+    try:
+        mtimes = {paths[folder]: mtime for folder, mtime in folder_mtimes(songs, paths, stopped).items()}
+    except OSError:
+        mtimes = {}
+    except Cancelled:
+        return None
+    known = cache.get_folder_sizes(mtimes) if cache is not None else {}
+    usage = dict(known)
+    missing = [path for path in paths.values() if path not in known]
+    done = len(known)
+    if on_progress is not None:
+        on_progress(done)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="osu!cleaner plan") as pool:
+        # the folders still running once stopped() turns true stop walking right away
+        for path, job in bounded_jobs(lambda path: pool.submit(folder_usage, path, stopped), missing, 2 * workers,
+                                      stopped):
+            usage[path] = job.result()
+            done += 1
+            if on_progress is not None:
+                on_progress(done)
+    if stopped is not None and stopped():
+        return None
+
+    if cache is not None:
+        measured = [(path, mtimes[path], *usage[path]) for path in missing if path in mtimes]
+        for start in range(0, len(measured), CACHE_BATCH):
+            if stopped is not None and stopped():
+                return None  # the batches stored so far are still right
+            cache.put_folder_sizes(measured[start:start + CACHE_BATCH])
+
+    sizes = {folder: usage[path][0] for folder, path in paths.items()}
+    files = sum(usage[path][1] for path in paths.values())
+    return Plan(sizes, files, len(known))
@@ -0,0 +1,130 @@
+import threading
+import time
+
+DEFAULT_RATE = 15  # updates per second, enough for a progress bar
+
+
+def _format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+    return f"{seconds // 60}:{seconds % 60:02}"
+
+
+class Reporter:
+    """
+    Coalesces the progress and status updates of every long-running phase.
+
+    Hot loops only store their latest values through update() and status(), a background thread
+    forwards them to the callbacks at most rate times per second. Only the latest status survives,
+    and once a phase has been running for a second its status is prefixed with an ETA.
+
+    on_init_progress(maximum) follows the progress bar convention used everywhere else:
+    0 means busy without known progress, -1 means idle.
+    """
+
+    def __init__(self, on_status=None, on_init_progress=None, on_progress=None, rate=DEFAULT_RATE):
+        self.on_status = on_status
+        self.on_init_progress = on_init_progress
+        self.on_progress = on_progress
+        self.interval = 1 / rate
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopped = threading.Event()
+        self.total = 0
+        self.done = 0
+        self.started = time.monotonic()
+        self.text = None
+        self.sent_done = None
+        self.sent_text = None
+
+    @property
+    def active(self):
+        return self.on_status is not None or self.on_init_progress is not None or self.on_progress is not None
+
+    @property
+    def throughput(self):
+        """Items per second since the current phase started."""
+        elapsed = time.monotonic() - self.started
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """Seconds left in the current phase, None while that can't be estimated yet."""
+        if self.total <= 0 or not 0 < self.done < self.total:
+            return None
+        elapsed = time.monotonic() - self.started
+        if elapsed < 1:
+            return None
+        return elapsed * (self.total - self.done) / self.done
+
+    def status(self, text):
+        self.text = text
+
+    def update(self, done):
+        self.done = done
+
+    def advance(self, count=1):
+        self.done += count
+
+    def start(self, total, status=None):
+        """Begins a new phase with total steps, the progress bar gets reset right away."""
+        with self.lock:
+            if status is not None:
+                self.text = status
+            self.total = total
+            self.done = 0
+            self.started = time.monotonic()
+            self.sent_done = 0
+            if self.on_init_progress is not None:
+                self.on_init_progress(total)
+            self._flush_status()
+        if self.active and self.thread is None:
+            self.stopped.clear()
+            self.thread = threading.Thread(target=self._run, name="osu!cleaner progress", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        """Stops the background thread and drops whatever is still pending, used when a phase got cancelled."""
+        if self.thread is not None:
+            self.stopped.set()
+            self.thread.join()
+            self.thread = None
+
+    def finish(self, status=None):
+        """Flushes everything still pending, hides the progress bar and stops the background thread."""
+        self.stop()
+        with self.lock:
+            self._flush()
+            self.total = 0
+            self.done = 0
+            if status is not None:
+                self.text = status
+            if self.on_init_progress is not None:
+                self.on_init_progress(-1)
+            self._flush_status()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            with self.lock:
+                self._flush()
+
+    def _flush(self):
+        done = self.done
+        if done != self.sent_done and self.total > 0:
+            self.sent_done = done
+            if self.on_progress is not None:
+                self.on_progress(done)
+        self._flush_status()
+
+    def _flush_status(self):
+        text = self.text
+        if text is None:
+            return
+        eta = self.eta
+        if eta is not None:
+            text = f"{_format_duration(eta)} left | {text}"
+        if text != self.sent_text:
+            self.sent_text = text
+            if self.on_status is not None:
+                self.on_status(text)
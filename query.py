@@ -0,0 +1,284 @@
+"""
+A small filter language over the beatmaps of osu!.db, see Engine.where.
+
+    mode == mania or (last_played < 2y and not in_collection)
+    stars >= 6.5 and status in (ranked, loved)
+    drain_time < 90s and not has_scores
+
+An expression keeps every beatmap it matches, a folder stays in Songs if one of its beatmaps is kept by
+it or by any other filter. Every comparison runs over a whole column of the BeatmapStore at once and
+gives one byte per row, and/or/not combine those as big ints. Over a million beatmaps that is about
+a tenth of a second per comparison, and only the fields the expression names have to be decoded from
+osu!.db for it (Query.fields), the default scan decodes none of them.
+
+Durations (90s, 5m, 12h, 10d, 3w, 6mo, 2y) compared with last_played or last_edit mean how long ago that
+was: `last_played < 2y` keeps what got played within the last two years, beatmaps that were never played
+count as infinitely long ago. drain_time and total_time are lengths, a plain number there means seconds.
+"""
+import datetime
+import operator
+import re
+from array import array
+from collections import namedtuple
+from itertools import compress
+
+from cancel import Cancelled
+from utils import datetime_to_ticks
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400, "mo": 30 * 86400, "y": 365 * 86400}
+TICKS_PER_SECOND = 10 ** 7
+CHUNK = 65536  # rows compared between two checks of stopped(), a few milliseconds
+MODES = {"osu": 0, "std": 0, "standard": 0, "taiko": 1, "ctb": 2, "catch": 2, "fruits": 2, "mania": 3}
+STATUSES = {"unknown": 0, "unsubmitted": 1, "pending": 2, "wip": 2, "graveyard": 2,
+            "ranked": 4, "approved": 5, "qualified": 6, "loved": 7}
+
+# what every name in an expression stands for, all but the flags and last_played are in utils.BEATMAP_FIELDS
+FLAGS = ("in_collection", "has_scores", "played")  # the other filters, true or false per beatmap
+ENUMS = {"mode": MODES, "status": STATUSES}
+NUMBERS = ("stars", "ar", "cs", "hp", "od", "beatmap_id", "mapset_id")
+LENGTHS = {"drain_time": 1, "total_time": 1000}  # units of the column per second
+AGES = ("last_played", "last_edit")
+KEYWORDS = ("and", "or", "not", "in")
+
+_OPS = {"==": operator.eq, "=": operator.eq, "!=": operator.ne,
+        "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+# x < value is value > x, the methods of value can then be mapped over a column without a lambda
+_REFLECTED = {"==": "__eq__", "=": "__eq__", "!=": "__ne__",
+              "<": "__gt__", "<=": "__ge__", ">": "__lt__", ">=": "__le__"}
+# less time since then is a later timestamp
+_AGE_OPS = {"<": ">", "<=": ">=", ">": "<", ">=": "<="}
+_TOKEN = re.compile(r"\s*(?:(?P<number>\d+(?:\.\d*)?|\.\d+)(?P<unit>[a-z]*)|(?P<name>[a-z_]\w*)"
+                    r"|(?P<op>[=!<>]=|[<>=(),])|(?P<end>$))", re.IGNORECASE)
+
+Token = namedtuple("Token", "kind value unit pos")
+
+
+class QueryError(ValueError):
+    """An expression that doesn't parse, the message tells where."""
+
+
+def tokenize(text):
+    pos = 0
+    while True:
+        match = _TOKEN.match(text, pos)
+        if match is None:
+            start = len(text) - len(text[pos:].lstrip())
+            raise QueryError(f"unexpected {text[start]!r} (column {start + 1})")
+        kind = match.lastgroup if match.lastgroup != "unit" else "number"
+        start = match.start(kind)
+        if kind == "number":
+            number = match.group("number")
+            yield Token(kind, float(number) if "." in number else int(number), match.group("unit").lower(), start)
+        elif kind == "end":
+            yield Token(kind, None, None, start)
+            return
+        else:
+            yield Token(kind, match.group(kind).lower() if kind == "name" else match.group(kind), None, start)
+        pos = match.end()
+
+
+class Query:
+    """
+    A parsed expression, raises QueryError if text isn't one.
+
+    fields are the optional BeatmapStore columns it needs, see utils.BEATMAP_FIELDS.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        parser = _Parser(text)
+        self.predicate = parser.parse()
+        self.fields = frozenset(parser.fields)
+
+    def rows(self, store, hashes, stopped=None):
+        """
+        Rows of store the expression matches, in order.
+
+        hashes are Engine.hashes, in_collection and has_scores look up their beatmaps in there.
+        Raises cancel.Cancelled once stopped() turns true, it gets checked before every comparison.
+        """
+        columns = _Columns(store, hashes, stopped)
+        mask = self.predicate(columns)
+        return array("I", compress(range(columns.size), mask.to_bytes(columns.size, "little")))
+
+
+class _Columns:
+    """What the predicates of a Query run against, every comparison returns a mask with one byte per row."""
+
+    def __init__(self, store, hashes, stopped):
+        self.store = store
+        self.hashes = hashes
+        self.stopped = stopped
+        self.size = len(store)
+        self.ones = int.from_bytes(b"\x01" * self.size, "little")
+        self.now = datetime_to_ticks(datetime.datetime.now())
+
+    def compare(self, name, op, value):
+        self.check()
+        column = self.store.last_played if name == "last_played" else self.store.fields[name]
+        if column.typecode == "B":
+            # a byte column gets translated in one go, the table holds the outcome for every possible byte
+            matches = column.tobytes().translate(bytes(_OPS[op](x, value) for x in range(256)))
+        else:
+            if column.typecode == "f":
+                value = array("f", [value])[0]  # stars >= 5.2 has to match 5.2 stored as a float32
+            test = getattr(value, _REFLECTED[op])
+            chunks = []
+            for start in range(0, len(column), CHUNK):
+                self.check()
+                chunks.append(bytes(map(test, column[start:start + CHUNK])))
+            matches = b"".join(chunks)
+        return int.from_bytes(matches, "little")
+
+    def check(self):
+        if self.stopped is not None and self.stopped():
+            raise Cancelled()
+
+    def flag(self, name):
+        if name == "played":
+            return self.compare("last_played", ">", 0)
+        self.check()
+        matches = bytearray(self.size)
+        for row in self.store.rows(self.hashes["collections" if name == "in_collection" else "scores"]):
+            matches[row] = 1
+        return int.from_bytes(matches, "little")
+
+
+def _either(left, right):
+    def predicate(columns):
+        mask = left(columns)
+        return mask if mask == columns.ones else mask | right(columns)
+    return predicate
+
+
+def _both(left, right):
+    def predicate(columns):
+        mask = left(columns)
+        return mask & right(columns) if mask else 0
+    return predicate
+
+
+def _negated(inner):
+    return lambda columns: columns.ones ^ inner(columns)
+
+
+class _Parser:
+    """Recursive descent over the tokens, builds the predicate right away. not binds tighter than and, and than or."""
+
+    def __init__(self, text):
+        self.tokens = list(tokenize(text))
+        self.i = 0
+        self.fields = set()
+
+    def take(self):
+        token = self.tokens[self.i]
+        if token.kind != "end":
+            self.i += 1
+        return token
+
+    def peek(self, kind, value):
+        token = self.tokens[self.i]
+        return token.kind == kind and token.value == value
+
+    def expect(self, op):
+        token = self.take()
+        if token.kind != "op" or token.value != op:
+            raise self.error(f"expected '{op}'", token)
+
+    @staticmethod
+    def error(message, token):
+        return QueryError(f"{message} (at the end)" if token.kind == "end" else f"{message} (column {token.pos + 1})")
+
+    def parse(self):
+        predicate = self.disjunction()
+        token = self.take()
+        if token.kind != "end":
+            raise self.error(f"unexpected {str(token.value)!r}", token)
+        return predicate
+
+    def disjunction(self):
+        predicate = self.conjunction()
+        while self.peek("name", "or"):
+            self.take()
+            predicate = _either(predicate, self.conjunction())
+        return predicate
+
+    def conjunction(self):
+        predicate = self.negation()
+        while self.peek("name", "and"):
+            self.take()
+            predicate = _both(predicate, self.negation())
+        return predicate
+
+    def negation(self):
+        if self.peek("name", "not"):
+            self.take()
+            return _negated(self.negation())
+        if self.peek("op", "("):
+            self.take()
+            predicate = self.disjunction()
+            self.expect(")")
+            return predicate
+        return self.comparison()
+
+    def comparison(self):
+        token = self.take()
+        if token.kind != "name" or token.value in KEYWORDS:
+            raise self.error("expected a field", token)
+        name = token.value
+        if name in FLAGS:
+            return lambda columns: columns.flag(name)
+        if name not in ENUMS and name not in NUMBERS and name not in LENGTHS and name not in AGES:
+            import difflib
+            known = [*FLAGS, *ENUMS, *NUMBERS, *LENGTHS, *AGES]
+            close = difflib.get_close_matches(name, known, 1)
+            raise self.error(f"unknown field {name!r}" + (f", did you mean {close[0]!r}?" if close else ""), token)
+        if name != "last_played":
+            self.fields.add(name)
+
+        token = self.take()
+        if token.kind == "name" and token.value == "in" and name not in AGES:
+            self.expect("(")
+            values = [self.value(name, self.take())]
+            while self.peek("op", ","):
+                self.take()
+                values.append(self.value(name, self.take()))
+            self.expect(")")
+            predicate = None
+            for value in values:
+                equal = self.compared(name, "==", value)
+                predicate = equal if predicate is None else _either(predicate, equal)
+            return predicate
+        if token.kind != "op" or token.value not in _OPS:
+            raise self.error(f"expected a comparison after {name!r}", token)
+        op = token.value
+        if name in AGES and op not in _AGE_OPS:
+            raise self.error(f"{name} can only be compared with <, <=, > or >=", token)
+        return self.compared(name, op, self.value(name, self.take()))
+
+    @staticmethod
+    def compared(name, op, value):
+        if name in AGES:
+            op = _AGE_OPS[op]
+            return lambda columns: columns.compare(name, op, columns.now - round(value * TICKS_PER_SECOND))
+        return lambda columns: columns.compare(name, op, value)
+
+    def value(self, name, token):
+        """What token stands for when compared with name, ages and lengths come out in seconds and column units."""
+        if name in ENUMS and token.kind == "name":
+            if token.value not in ENUMS[name]:
+                raise self.error(f"unknown {name} {token.value!r}, one of {', '.join(ENUMS[name])}", token)
+            return ENUMS[name][token.value]
+        if token.kind != "number":
+            raise self.error(f"expected a value for {name}", token)
+        if token.unit and token.unit not in UNITS:
+            raise self.error(f"unknown unit {token.unit!r}, one of {', '.join(UNITS)}", token)
+        if name in AGES:
+            if not token.unit:
+                raise self.error(f"{name} needs a duration like 2y or 30d", token)
+            return token.value * UNITS[token.unit]
+        if name in LENGTHS:
+            return token.value * UNITS[token.unit or "s"] * LENGTHS[name]
+        if token.unit:
+            raise self.error(f"{name} is a plain number", token)
+        return token.value
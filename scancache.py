@@ -0,0 +1,151 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import sys
+import time
+from pathlib import Path
+
+from utils import file_signature
+
+CACHE_FORMAT = 6  # bump whenever the shape of a cached result changes
+FINGERPRINT_SIZE = 64 * 1024
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+FOLDER_SIZE_TTL = 90 * 24 * 3600  # folder sizes and file hashes nobody asked for in this long get dropped
+
+
+def get_cache_dir():
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+        return Path(base) / "osu!cleaner"
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return Path(base) / "osu-cleaner"
+
+
+def fingerprint(filename):
+    """Cheap content check on top of size and mtime, hashes the beginning of the file."""
+    with open(filename, "rb") as f:
+        return hashlib.blake2b(f.read(FINGERPRINT_SIZE), digest_size=16).digest()
+
+
+class ScanCache:
+    """
+    Persistent cache of parsed database results, stored in a small SQLite file.
+
+    Every entry is keyed on the absolute path of the database it was parsed from and is only
+    returned while that file still has the same size, mtime and fingerprint.
+    Entries of databases that disappeared are dropped and the rest is evicted
+    least-recently-used first once the cache grows beyond max_bytes.
+
+    It also remembers the size of beatmap folders, keyed on the mtime of the folder, see planner.py,
+    and the MD5 of files in them, keyed on size and mtime of the file, see duplicates.py.
+    """
+
+    def __init__(self, filename=None, max_bytes=MAX_CACHE_BYTES):
+        if filename is None:
+            filename = get_cache_dir() / "scan_cache.sqlite"
+        Path(filename).parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.db = sqlite3.connect(str(filename))
+        self.db.execute("PRAGMA auto_vacuum = FULL")  # only takes effect on a new file, keeps it from growing
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries ("
+                        "path TEXT PRIMARY KEY, format INTEGER, size INTEGER, mtime INTEGER, "
+                        "fingerprint BLOB, last_used REAL, payload BLOB)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS folder_sizes ("
+                        "path TEXT PRIMARY KEY, mtime INTEGER, size INTEGER, files INTEGER, last_used REAL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS file_hashes ("
+                        "path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, digest BLOB, last_used REAL)")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def key(filename):
+        return (*file_signature(filename), fingerprint(filename))
+
+    def get(self, filename, key):
+        path = os.path.abspath(filename)
+        row = self.db.execute("SELECT format, size, mtime, fingerprint, payload FROM entries WHERE path = ?",
+                              (path,)).fetchone()
+        if row is None or row[0] != CACHE_FORMAT or tuple(row[1:4]) != key:
+            return None
+        self.db.execute("UPDATE entries SET last_used = ? WHERE path = ?", (time.time(), path))
+        self.db.commit()
+        return pickle.loads(row[4])
+
+    def put(self, filename, key, result):
+        payload = pickle.dumps(result, pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.max_bytes:
+            return
+        self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (os.path.abspath(filename), CACHE_FORMAT, *key, time.time(), payload))
+        self.evict()
+        self.db.commit()
+
+    def evict(self):
+        rows = self.db.execute("SELECT path, format, length(payload) FROM entries ORDER BY last_used DESC").fetchall()
+        total = 0
+        stale = []
+        for path, cache_format, size in rows:
+            if cache_format != CACHE_FORMAT or not os.path.exists(path) or total + size > self.max_bytes:
+                stale.append((path,))
+            else:
+                total += size
+        self.db.executemany("DELETE FROM entries WHERE path = ?", stale)
+
+    def get_folder_sizes(self, mtimes):
+        """Returns path -> (size, files) for every folder in mtimes (path -> mtime) that didn't change since."""
+        hits = {}
+        touched = []
+        now = time.time()
+        paths = list(mtimes)
+        for start in range(0, len(paths), 500):  # stay below SQLite's limit of query parameters
+            chunk = paths[start:start + 500]
+            rows = self.db.execute("SELECT path, mtime, size, files, last_used FROM folder_sizes "
+                                   f"WHERE path IN ({', '.join('?' * len(chunk))})", chunk)
+            for path, mtime, size, files, last_used in rows:
+                if mtimes[path] == mtime:
+                    hits[path] = size, files
+                    if last_used < now - 24 * 3600:  # a day is precise enough for the TTL, saves most writes
+                        touched.append((now, path))
+        if touched:
+            self.db.executemany("UPDATE folder_sizes SET last_used = ? WHERE path = ?", touched)
+            self.db.commit()
+        return hits
+
+    def put_folder_sizes(self, rows):
+        """Stores (path, mtime, size, files) rows."""
+        now = time.time()
+        self.db.executemany("INSERT OR REPLACE INTO folder_sizes VALUES (?, ?, ?, ?, ?)",
+                            [(*row, now) for row in rows])
+        self.db.execute("DELETE FROM folder_sizes WHERE last_used < ?", (now - FOLDER_SIZE_TTL,))
+        self.db.commit()
+
+    def get_file_hashes(self, stats):
+        """Returns path -> digest for every file in stats (path -> (size, mtime)) that didn't change since."""
+        hits = {}
+        touched = []
+        now = time.time()
+        paths = list(stats)
+        for start in range(0, len(paths), 500):
+            chunk = paths[start:start + 500]
+            rows = self.db.execute("SELECT path, size, mtime, digest, last_used FROM file_hashes "
+                                   f"WHERE path IN ({', '.join('?' * len(chunk))})", chunk)
+            for path, size, mtime, digest, last_used in rows:
+                if stats[path] == (size, mtime):
+                    hits[path] = digest
+                    if last_used < now - 24 * 3600:
+                        touched.append((now, path))
+        if touched:
+            self.db.executemany("UPDATE file_hashes SET last_used = ? WHERE path = ?", touched)
+            self.db.commit()
+        return hits
+
+    def put_file_hashes(self, rows):
+        """Stores (path, size, mtime, digest) rows."""
+        now = time.time()
+        self.db.executemany("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?)",
+                            [(*row, now) for row in rows])
+        self.db.execute("DELETE FROM file_hashes WHERE last_used < ?", (now - FOLDER_SIZE_TTL,))
+        self.db.commit()
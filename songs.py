@@ -0,0 +1,56 @@
+"""
+Diff of the Songs folder against the directories osu!.db lists.
+
+osu!.db only knows the folders osu! imported. Folders that were copied in by hand or whose import
+failed (orphans) are never touched by a Cleanup unless asked to, folders osu!.db lists that are gone
+from disk (missing) are left out of every count and move.
+
+Songs is listed once with os.scandir, which gets the entry types from the same system call on both
+Windows and Linux, so tens of thousands of folders take a few milliseconds once the listing is cached.
+"""
+import os
+
+from cancel import checked
+
+# Windows' file systems don't care about case, osu!.db and the listing can disagree on it
+_key = str.casefold if os.name == "nt" else str
+
+
+def list_folders(songs, stopped=None):
+    """Names of the folders directly inside songs, raises cancel.Cancelled once stopped() turns true."""
+    folders = []
+    with os.scandir(songs) as entries:
+        for entry in checked(entries, stopped, 256):
+            try:
+                if entry.is_dir():
+                    folders.append(entry.name)
+            except OSError:
+                continue
+    return folders
+
+
+def diff_songs(songs, on_disk, directories):
+    """
+    Returns (orphans, missing): folders of on_disk that none of directories belong to,
+    and directories that aren't on disk. Both are sorted.
+
+    Directories in a subfolder of Songs keep the top folder they're in from being an orphan,
+    they are checked on disk one by one since the listing only covers the top level.
+    """
+    listed = {_key(folder): folder for folder in on_disk}
+    known = set()
+    missing = []
+    for directory in directories:
+        if not directory:
+            continue
+        top, separator, _ = directory.replace("\\", "/").partition("/")
+        key = _key(top)
+        known.add(key)
+        if separator:
+            exists = os.path.isdir(os.path.join(songs, directory))
+        else:
+            exists = key in listed
+        if not exists:
+            missing.append(directory)
+    orphans = [folder for key, folder in listed.items() if key not in known]
+    return sorted(orphans), sorted(missing)
@@ -0,0 +1,210 @@
+"""
+Columnar storage for the beatmaps of an osu!.db.
+
+A million difficulties as a dict of hex strings plus one object per beatmap costs hundreds of MB,
+the same data as a few flat arrays takes about 36 bytes per beatmap and pickles in one go.
+"""
+import heapq
+import sys
+from array import array
+from binascii import unhexlify
+from bisect import bisect_left, bisect_right
+
+from cancel import checked
+
+DIGEST_SIZE = 16  # MD5
+_PREFIX_SIZE = 4  # leading digest bytes kept in an int column, narrows every lookup to a handful of rows
+
+
+def to_digest(h):
+    """Turns a 32 character hex MD5 (str or bytes) into its 16-byte digest, None if it isn't one."""
+    if len(h) != 2 * DIGEST_SIZE:
+        return None
+    try:
+        return unhexlify(h)
+    except ValueError:
+        return None
+
+
+class BeatmapColumns:
+    """
+    Beatmaps as collected by a single osu!.db loader, in file order until sort() gets called.
+
+    Directories are interned, every row only stores the id of its directory. fields maps the names of
+    optional columns to their array typecode, see utils.BEATMAP_FIELDS; the loader appends to those itself.
+    """
+
+    def __init__(self, fields=None):
+        self.digests = bytearray()
+        self.directory_ids = array("I")
+        self.last_played = array("q")  # ticks, 0 if never played
+        self.fields = {name: array(typecode) for name, typecode in (fields or {}).items()}
+        self.directories = []
+        self.sorted = False
+        self._ids = {}
+
+    def __len__(self):
+        return len(self.directory_ids)
+
+    def append(self, digest, directory, last_played):
+        i = self._ids.get(directory)
+        if i is None:
+            i = self._ids[directory] = len(self.directories)
+            self.directories.append(directory)
+        self.digests += digest
+        self.directory_ids.append(i)
+        self.last_played.append(last_played)
+
+    def sort(self):
+        """Puts the rows in digest order, rows with the same digest stay in file order. Done in the loader's process."""
+        digests = bytes(self.digests)
+        # digest + row number as one bytes object keeps the sort a plain C comparison
+        records = [digests[i:i + DIGEST_SIZE] + (i // DIGEST_SIZE).to_bytes(4, "big")
+                   for i in range(0, len(digests), DIGEST_SIZE)]
+        records.sort()
+        rows = [int.from_bytes(record[DIGEST_SIZE:], "big") for record in records]
+        self.digests = bytearray().join(record[:DIGEST_SIZE] for record in records)
+        del records
+        self.directory_ids = array("I", (self.directory_ids[row] for row in rows))
+        self.last_played = array("q", (self.last_played[row] for row in rows))
+        for name, column in self.fields.items():
+            self.fields[name] = array(column.typecode, (column[row] for row in rows))
+        self.sorted = True
+
+    def stream(self, part):
+        """Yields (digest, part, row, directory, last_played) in row order, see BeatmapStore.merge."""
+        digests = self.digests
+        directories = self.directories
+        for row, (i, ticks) in enumerate(zip(self.directory_ids, self.last_played)):
+            yield digests[row * DIGEST_SIZE:(row + 1) * DIGEST_SIZE], part, row, directories[i], ticks
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_ids"]  # rebuilt on demand, no need to send it between processes
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._ids = {directory: i for i, directory in enumerate(self.directories)}
+
+
+class BeatmapStore:
+    """
+    Read-only beatmap table sorted by digest.
+
+    Row r is digests[16 * r:16 * r + 16], directory_ids[r], last_played[r] and fields[name][r] for
+    whichever optional columns got decoded. Lookups bisect the prefix column and then search the few
+    matching rows of the digest column, both at C speed.
+    """
+
+    def __init__(self, digests=b"", directory_ids=None, last_played=None, directories=None,
+                 shadow_rows=None, shadow_directories=None, fields=None):
+        self.digests = bytes(digests)
+        self.directory_ids = directory_ids if directory_ids is not None else array("I")
+        self.last_played = last_played if last_played is not None else array("q")
+        self.fields = fields if fields is not None else {}  # name -> array, see utils.BEATMAP_FIELDS
+        self.directories = directories if directories is not None else []
+        # rows that were also listed in another directory and the directory they were dropped from, see merge
+        self.shadow_rows = shadow_rows if shadow_rows is not None else array("I")
+        self.shadow_directories = shadow_directories if shadow_directories is not None else []
+        # every 4th 4-byte word of the digest column is the start of a digest, read big-endian so it sorts like the digest
+        self.prefixes = array("I")
+        self.prefixes.frombytes(memoryview(self.digests).cast("I")[::DIGEST_SIZE // _PREFIX_SIZE].tobytes())
+        if sys.byteorder == "little":
+            self.prefixes.byteswap()
+
+    @classmethod
+    def merge(cls, parts, stopped=None):
+        """
+        Builds the store from BeatmapColumns in file order, raises cancel.Cancelled once stopped() turns true.
+
+        Parts come sorted from their loaders (unsorted ones get sorted here) and are merged in a single
+        streaming pass, so the only things that grow are the columns of the store itself.
+        A digest that shows up more than once keeps its last row, same as inserting them into a dict.
+        The directories the other copies were in are kept as shadows of that row, see duplicates.py.
+        Directories get dense ids in order of first use, ones without any row left are dropped.
+        Every part has to have the same optional fields.
+        """
+        parts = list(parts)  # walked twice, merge_beatmaps gets a generator
+        for part in parts:
+            if not part.sorted:
+                part.sort()
+        streams = [part.stream(k) for k, part in enumerate(parts)]
+        # equal digests come out in part order and then row order, which is file order
+        records = checked(streams[0] if len(streams) == 1 else heapq.merge(*streams), stopped)
+
+        digests = bytearray()
+        directory_ids = array("I")
+        last_played = array("q")
+        shadow_rows = array("I")
+        shadow_directories = []
+        ids = {}
+        fields = {name: array(column.typecode) for name, column in parts[0].fields.items()} if parts else {}
+        extras = [(fields[name].append, [part.fields[name] for part in parts]) for name in fields]
+        held = None  # the last copy of the current digest wins, so each row is only written once the next digest shows up
+        copies = []
+        for record in records:
+            if held is not None and record[0] != held[0]:
+                cls._write(held, copies, digests, directory_ids, last_played, ids, shadow_rows, shadow_directories,
+                           extras)
+                copies = []
+            elif held is not None:
+                copies.append(held[3])
+            held = record
+        if held is not None:
+            cls._write(held, copies, digests, directory_ids, last_played, ids, shadow_rows, shadow_directories,
+                       extras)
+        return cls(digests, directory_ids, last_played, list(ids), shadow_rows, shadow_directories, fields)
+
+    @staticmethod
+    def _write(record, copies, digests, directory_ids, last_played, ids, shadow_rows, shadow_directories, extras):
+        digest, part, row, directory, ticks = record
+        i = ids.get(directory)
+        if i is None:
+            i = ids[directory] = len(ids)
+        if copies:
+            # the same beatmap listed twice in one directory isn't a copy of anything
+            for copy in dict.fromkeys(copies):
+                if copy != directory:
+                    shadow_rows.append(len(directory_ids))
+                    shadow_directories.append(copy)
+        digests += digest
+        directory_ids.append(i)
+        last_played.append(ticks)
+        for append, columns in extras:
+            append(columns[part][row])
+
+    def __len__(self):
+        return len(self.directory_ids)
+
+    def find(self, digest):
+        """Row of the given digest, -1 if it isn't in the store."""
+        key = int.from_bytes(digest[:_PREFIX_SIZE], "big")
+        lo = bisect_left(self.prefixes, key)
+        hi = bisect_right(self.prefixes, key, lo)
+        if lo == hi:
+            return -1
+        segment = self.digests[lo * DIGEST_SIZE:hi * DIGEST_SIZE]
+        offset = segment.find(digest)
+        while offset > 0 and offset % DIGEST_SIZE:  # only rows count, not a match across two of them
+            offset = segment.find(digest, offset + 1)
+        return -1 if offset < 0 else lo + offset // DIGEST_SIZE
+
+    def rows(self, hashes):
+        """Yields the rows of every hex hash that is in the store, unknown or malformed ones are skipped."""
+        find = self.find
+        for h in hashes:
+            digest = to_digest(h)
+            if digest is not None:
+                row = find(digest)
+                if row >= 0:
+                    yield row
+
+    def played(self):
+        """Rows of every beatmap that was played at least once."""
+        return array("I", (row for row, ticks in enumerate(self.last_played) if ticks > 0))
+
+    def directory_of(self, h):
+        digest = to_digest(h)
+        row = self.find(digest) if digest is not None else -1
+        return self.directories[self.directory_ids[row]] if row >= 0 else None
@@ -0,0 +1,210 @@
+"""
+Optional instrumentation: spans and counters for every phase of a run.
+
+Tracing is off unless enable() gets called, cli.py does that for --trace and both entry points do it
+when OSU_CLEANER_TRACE names a file. While it is off, span() hands out one shared do-nothing
+context manager and count() returns right away, so instrumented code costs a function call.
+
+The result is a Chrome trace (open it in chrome://tracing or ui.perfetto.dev) and a summary table.
+Worker processes forward their events to the tracer of the process that started them, see collector().
+"""
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+ENV_VARIABLE = "OSU_CLEANER_TRACE"
+
+_tracer = None
+
+
+def _now_us():
+    return time.perf_counter_ns() // 1000
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ("tracer", "name", "args", "start")
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.start = 0
+
+    def __enter__(self):
+        self.start = _now_us()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = exc_type.__name__
+        self.tracer.add({"name": self.name, "ph": "X", "ts": self.start, "dur": _now_us() - self.start,
+                         "pid": self.tracer.pid, "tid": threading.get_ident(), "args": self.args})
+        return False
+
+    def set(self, **args):
+        """Attaches more arguments to the span, shown next to it in the trace viewer."""
+        self.args.update(args)
+
+
+class Tracer:
+    def __init__(self, process_name="osu!cleaner", forward=None):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.events = []
+        self.totals = {}  # counter name -> sum over every process
+        self.running = {}  # counter name -> sum in this process
+        self.forward = forward  # queue to the parent process, set in workers
+        self.queues = []
+        self.add({"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": process_name}})
+
+    def add(self, event, delta=None):
+        if self.forward is not None:
+            self.forward.put((event, delta))
+            return
+        with self.lock:
+            self.events.append(event)
+            if delta is not None:
+                name = event["name"]
+                self.totals[name] = self.totals.get(name, 0) + delta
+
+    def span(self, name, **args):
+        return Span(self, name, args)
+
+    def count(self, name, value=1):
+        # the trace shows the running total of this process, the summary adds up all processes
+        with self.lock:
+            total = self.running[name] = self.running.get(name, 0) + value
+        self.add({"name": name, "ph": "C", "ts": _now_us(), "pid": self.pid, "args": {"value": total}}, value)
+
+    def collector(self, context):
+        queue = context.SimpleQueue()
+        self.queues.append(queue)
+        return queue
+
+    def drain(self):
+        """Collects everything the workers sent so far, has to be called while they run so their pipe never fills up."""
+        for queue in self.queues:
+            while not queue.empty():
+                self.add(*queue.get())
+
+    def chrome_trace(self):
+        self.drain()
+        with self.lock:
+            return {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+
+    def summary(self):
+        """Time per span name and the total of every counter, as a text table."""
+        self.drain()
+        spans = {}
+        with self.lock:
+            for event in self.events:
+                if event["ph"] == "X":
+                    calls, total, longest = spans.get(event["name"], (0, 0, 0))
+                    spans[event["name"]] = calls + 1, total + event["dur"], max(longest, event["dur"])
+            totals = dict(self.totals)
+        width = max([len(name) for name in [*spans, *totals]] + [4])
+        lines = [f"{'span':<{width}}{'calls':>8}{'total':>12}{'longest':>12}"]
+        for name, (calls, total, longest) in sorted(spans.items(), key=lambda item: -item[1][1]):
+            lines.append(f"{name:<{width}}{calls:>8}{total / 1000:>9.1f} ms{longest / 1000:>9.1f} ms")
+        if totals:
+            lines.append("")
+            lines.append(f"{'counter':<{width}}{'total':>12}")
+            for name, total in sorted(totals.items()):
+                lines.append(f"{name:<{width}}{total:>12,}")
+        return "\n".join(lines)
+
+    def write(self, filename):
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(self.chrome_trace(), f)
+
+
+def enabled():
+    return _tracer is not None
+
+
+def enable(filename=None):
+    """Starts tracing this process. With a filename, the trace is written and the summary printed at exit."""
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+        if filename:
+            import atexit
+            atexit.register(finish, filename)
+    return _tracer
+
+
+def enable_from_env():
+    filename = os.environ.get(ENV_VARIABLE)
+    if filename:
+        enable(filename)
+
+
+def forward_to(queue, process_name):
+    """Traces a worker process into the given queue, see collector()."""
+    global _tracer
+    _tracer = Tracer(process_name, forward=queue)
+
+
+def finish(filename=None, out=sys.stderr):
+    """Writes the trace (if given a filename) and prints the summary, does nothing while tracing is off."""
+    if _tracer is None:
+        return
+    if filename:
+        _tracer.write(filename)
+    if out is not None:
+        print(_tracer.summary(), file=out)
+        if filename:
+            print(f"trace written to {filename}", file=out)
+
+
+def span(name, **args):
+    if _tracer is None:
+        return _NULL_SPAN
+    return _tracer.span(name, **args)
+
+
+def count(name, value=1):
+    if _tracer is not None:
+        _tracer.count(name, value)
+
+
+def traced(name):
+    """Decorator that wraps every call of a function in a span."""
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _tracer is None:
+                return function(*args, **kwargs)
+            with _tracer.span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def collector(context):
+    """Queue for the workers of a pool created from context to forward their events through, None while off."""
+    if _tracer is None:
+        return None
+    return _tracer.collector(context)
+
+
+def drain():
+    if _tracer is not None:
+        _tracer.drain()
@@ -1,14 +1,46 @@
 import datetime
+import mmap
+import os
 import re
+import struct
 from pathlib import Path
-from winreg import ConnectRegistry, OpenKey, EnumValue, HKEY_LOCAL_MACHINE
 
-from osu import OsuDb, BeatmapMetadata, Permissions, TimingPoint
-from osu.utility import BinaryFile
-import time
+from cancel import checked
+from store import to_digest
+
+# osu!.db layout changes, see https://github.com/ppy/osu/wiki/Legacy-database-file-structure
+VERSION_FLOAT_DIFFICULTY = 20140609  # AR/CS/HP/OD became floats, star ratings were added
+VERSION_NO_ENTRY_SIZE = 20191106  # beatmap entries are no longer prefixed with their size
+VERSION_FLOAT_STAR_RATING = 20250107  # star rating pairs switched from double to float
+
+_INT = struct.Struct("<i")
+_INT2 = struct.Struct("<ii")
+_LONG = struct.Struct("<q")
+_FLOAT = struct.Struct("<f")
+_DOUBLE = struct.Struct("<d")
+_HEADER = struct.Struct("<iiBq")  # version, mapsetCount, accountUnlocked, unrestrictionTime
+_TIMESTAMP_MIN = datetime.datetime(1, 1, 1)
+_MD5 = re.compile(r"[0-9a-f]{32}")
+# a beatmap entry in scores.db: hash, score count, then a score for that same hash
+_SCORES_ENTRY = re.compile(rb"\x0b\x20([0-9a-f]{32}).{4}[\x00-\x03].{4}\x0b\x20\1", re.DOTALL)
+
+# fixed-width runs between the variable-length fields of a beatmap entry
+_STATE_TO_LAST_EDIT = 1 + 2 * 3  # state, circles, sliders, spinners
+_TIMES = 4 * 3  # drainTime, totalTime, previewTime
+_TIMING_POINT = 8 + 8 + 1  # bpm, offset, inherited
+_IDS_TO_MODE = 4 * 3 + 4 + 2 + 4 + 1  # mapID, mapsetID, threadID, grades, offset, stackLeniency, mode
+_DIFFICULTY = 4 * 4 + 8  # AR, CS, HP, OD as floats, SV
+_AFTER_DIRECTORY = 8 + 4 + 2 + 4  # lastSync, disable* flags, bgDim, last modification
+_SCORE_TO_MODS = 2 * 6 + 4 + 2 + 1  # 300s, 100s, 50s, gekis, katus, misses, score, maxCombo, perfect
+_SCORE_TAIL = 8 + 4 + 8  # timestamp, -1, onlineScoreID
+MOD_TARGET_PRACTICE = 1 << 23
 
 
 def get_osu_path():
+    try:
+        from winreg import ConnectRegistry, OpenKey, EnumValue, HKEY_LOCAL_MACHINE
+    except ImportError:  # not on Windows, there is no registry to ask
+        return False
     string_pattern = re.compile('\"(.+?)\"')
     reg = ConnectRegistry(None, HKEY_LOCAL_MACHINE)
     # get osu! path
@@ -24,106 +56,391 @@ def get_osu_path():
     return Path(path).parent
 
 
-class SmallOsuDb(OsuDb):
-    def __init__(self, filename, reference):
-        self.reference = reference
-        super().__init__(filename)
+def file_signature(filename):
+    """Size and mtime of a file, used to notice if osu! rewrote it while we were reading."""
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
 
-    def load(self, filename):
-        BinaryFile.__init__(self, filename, 'r')
 
-        self.version = self.readInt()
-        self.mapsetCount = self.readInt()
-        self.accountUnlocked = self.readByte() != 0
-        self.unrestrictionTime = self.readOsuTimestamp()
-        self.username = self.readOsuString()
-        beatmapCnt = self.readInt()
+def ticks_to_datetime(ticks):
+    # same conversion osu.py uses for readOsuTimestamp, ticks are 100ns since 0001-01-01
+    if ticks <= 0:
+        return _TIMESTAMP_MIN
+    try:
+        return _TIMESTAMP_MIN + datetime.timedelta(microseconds=ticks // 10)
+    except OverflowError:
+        return _TIMESTAMP_MIN
+
+
+def datetime_to_ticks(moment):
+    return (moment - _TIMESTAMP_MIN) // datetime.timedelta(microseconds=1) * 10
+
+
+def _uleb128(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def skip_string(buf, pos):
+    """Returns the offset behind the osu! string at pos without decoding it."""
+    if buf[pos] == 0:
+        return pos + 1
+    length = buf[pos + 1]
+    if length & 0x80:  # multi-byte length, rare
+        length, pos = _uleb128(buf, pos + 1)
+        return pos + length
+    return pos + 2 + length
+
+
+def read_string(buf, pos):
+    """Returns the osu! string at pos and the offset behind it."""
+    if buf[pos] == 0:
+        return "", pos + 1
+    length, pos = _uleb128(buf, pos + 1)
+    end = pos + length
+    return buf[pos:end].decode("utf-8", "replace"), end
+
+
+class SmallOsuDb:
+    """
+    Minimal osu!.db reader that only extracts what osu!cleaner needs.
+
+    The file is memory-mapped and every field we don't care about is skipped
+    using its known width (or its ULEB128 length for strings) instead of being decoded.
+    Passing offset and count only decodes that range of beatmap entries, see shards().
+    Passing a store.BeatmapColumns fills it instead of creating a SmallBeatmapMetadata per beatmap,
+    decoding only the optional fields it was created with on top of hash, directory and lastPlayed.
+    Progress goes to progress.start(total) and progress.update(done), see progress.Reporter.
+    """
+
+    def __init__(self, filename, progress, offset=None, count=None, columns=None):
+        self.progress = progress
+        self.load(filename, offset, count, columns)
+
+    def load(self, filename, offset=None, count=None, columns=None):
+        with open(filename, "rb") as f:
+            self.inFile = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = self.inFile
+
+        self.version, self.mapsetCount, unlocked, _ = _HEADER.unpack_from(buf, 0)
+        self.accountUnlocked = unlocked != 0
+        self.username, pos = read_string(buf, _HEADER.size)
+        self.beatmapCount = _INT.unpack_from(buf, pos)[0]
+        self.firstBeatmap = pos + 4
+        if offset is None:
+            offset, count = self.firstBeatmap, self.beatmapCount
 
         self.beatmaps = []
 
-        self.reference.init_progress.emit(beatmapCnt)
-        start = time.time()
-        for i in range(beatmapCnt):
-            self.beatmaps.append(SmallBeatmapMetadata.fromOsuDb(self))
+        self.progress.start(count)
+        pos = offset
+        if columns is not None:
+            self.end = self.load_columns(buf, pos, count, columns)
+            return
+        for i in range(count):
+            bm, pos = SmallBeatmapMetadata.fromBuffer(buf, pos, self.version)
+            self.beatmaps.append(bm)
+
+            if not i & 0x3ff:
+                self.progress.update(i + 1)
+        self.progress.update(count)
+        self.end = pos
+
+    def load_columns(self, buf, pos, count, columns):
+        directories = {}  # raw string bytes -> decoded directory, most directories hold several beatmaps
+        version = self.version
+        # only the fields a query asked for get decoded, see BEATMAP_FIELDS
+        decoders = [(column.append, BEATMAP_FIELDS[name][1]) for name, column in columns.fields.items()]
+        for i in range(count):
+            entry = _walk_beatmap(buf, pos, version)
+            hash_pos, _, _, _, last_played_pos, directory_pos, pos = entry
+            # entries without a proper MD5 can't be matched against any filter, they are dropped from the store
+            digest = to_digest(buf[hash_pos + 2:hash_pos + 34]) if buf[hash_pos] == 0x0b and buf[hash_pos + 1] == 32 else None
+            if digest is not None:
+                raw = buf[directory_pos:skip_string(buf, directory_pos)]
+                directory = directories.get(raw)
+                if directory is None:
+                    directory = directories[raw] = read_string(raw, 0)[0]
+                columns.append(digest, directory, _LONG.unpack_from(buf, last_played_pos)[0])
+                for append, decode in decoders:
+                    append(decode(buf, entry, version))
+
+            if not i & 0x3ff:
+                self.progress.update(i + 1)
+        self.progress.update(count)
+        return pos
 
-            now = time.time()
-            if now - start >= 1 / 15:  # 15 fps update
-                start = now
-                self.reference.update_progress.emit(i + 1)
+    @staticmethod
+    def shards(filename, max_parts, min_size, stopped=None):
+        """
+        Splits the beatmap entries of an osu!.db into up to max_parts ranges of at least min_size entries.
+
+        Yields (offset, count, share) per range as soon as its offset is known, share is the fraction
+        of all entries it covers. Entries are only walked over to find the offsets, nothing gets decoded.
+        Raises cancel.Cancelled once stopped() turns true, the walk takes seconds for a million entries.
+        """
+        with open(filename, "rb") as f:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
         try:
-            if self.username:
-                self.permissions = Permissions(self.readInt())
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except:
-            pass
+            version = _INT.unpack_from(buf, 0)[0]
+            pos = skip_string(buf, _HEADER.size)
+            beatmap_count = _INT.unpack_from(buf, pos)[0]
+            pos += 4
+            parts = max(1, min(max_parts, beatmap_count // max(min_size, 1)))
+            per_part = -(-beatmap_count // parts) if beatmap_count else 1
+            for first in range(0, beatmap_count, per_part):
+                if first:
+                    for _ in checked(range(per_part), stopped):
+                        pos = _walk_beatmap(buf, pos, version)[-1]
+                count = min(per_part, beatmap_count - first)
+                yield pos, count, count / beatmap_count
+        finally:
+            buf.close()
+
+
+class SmallCollectionDb:
+    """
+    Streaming collection.db reader.
+
+    Iterating yields (name, hashes) one collection at a time straight from the memory-mapped file,
+    nothing else is kept around.
+    """
+
+    def __init__(self, filename):
+        with open(filename, "rb") as f:
+            self.inFile = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.version, self.collectionCount = _INT2.unpack_from(self.inFile, 0)
+
+    def __iter__(self):
+        buf = self.inFile
+        pos = _INT2.size
+        for _ in range(self.collectionCount):
+            name, pos = read_string(buf, pos)
+            count = _INT.unpack_from(buf, pos)[0]
+            pos += 4
+            hashes = []
+            for _ in range(count):
+                h, pos = read_string(buf, pos)
+                hashes.append(h)
+            yield name, hashes
+
+
+class ScoreRecordError(ValueError):
+    pass
 
 
-class SmallBeatmapMetadata(BeatmapMetadata):
+class SmallScoresDb:
+    """
+    scores.db scanner that only collects which beatmaps have scores and how many.
+
+    Score bodies are skipped using their known field widths. A record that doesn't parse is reported in
+    self.errors and the scan resumes at the next beatmap entry instead of giving up on the whole file.
+    Progress is reported in bytes.
+    """
+
+    def __init__(self, filename, progress):
+        self.progress = progress
+        self.load(filename)
+
+    def load(self, filename):
+        with open(filename, "rb") as f:
+            self.inFile = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = self.inFile
+        self.version, self.beatmapCount = _INT2.unpack_from(buf, 0)
+
+        self.scoreCounts = {}
+        self.errors = []
+
+        end = len(buf)
+        pos = _INT2.size
+        self.progress.start(end)
+        i = 0
+        while pos < end:
+            entry_start = pos
+            h = None
+            parsed = 0
+            try:
+                h, pos = read_string(buf, pos)
+                if not _MD5.fullmatch(h):
+                    raise ScoreRecordError(f"{h!r} is not a beatmap hash")
+                encoded = h.encode()
+                count = _INT.unpack_from(buf, pos)[0]
+                pos += 4
+                for _ in range(count):
+                    pos = self.skip_score(buf, pos, encoded)
+                    parsed += 1
+                self.scoreCounts[h] = count
+            except (IndexError, struct.error, UnicodeDecodeError, ScoreRecordError) as err:
+                if parsed:
+                    self.scoreCounts[h] = parsed
+                self.errors.append(f"beatmap entry at byte {entry_start}, score {parsed + 1}: {err}")
+                match = _SCORES_ENTRY.search(buf, entry_start + 1)
+                if match is None:
+                    break
+                pos = match.start()
+
+            i += 1
+            if not i & 0xff:
+                self.progress.update(pos)
+        self.progress.update(end)
+
+    @staticmethod
+    def skip_score(buf, pos, encoded_hash):
+        """Returns the offset behind the score at pos, checking that it belongs to the expected beatmap."""
+        if buf[pos] > 3:
+            raise ScoreRecordError(f"unknown game mode {buf[pos]}")
+        pos += 1 + 4  # mode, version
+        if buf[pos] != 0x0b or buf[pos + 1] != 32 or buf[pos + 2:pos + 34] != encoded_hash:
+            raise ScoreRecordError("score doesn't belong to this beatmap")
+        pos += 34
+        pos = skip_string(buf, pos)  # player name
+        pos = skip_string(buf, pos)  # replay hash
+        mods = _INT.unpack_from(buf, pos + _SCORE_TO_MODS)[0]
+        pos = skip_string(buf, pos + _SCORE_TO_MODS + 4)  # life bar graph
+        pos += _SCORE_TAIL
+        if mods & MOD_TARGET_PRACTICE:
+            pos += 8  # target practice accuracy
+        if pos > len(buf):
+            raise ScoreRecordError("score is cut off")
+        return pos
+
+
+class SmallBeatmapMetadata:
+    __slots__ = ("hash", "beatmapFile", "lastEdit", "lastPlayed", "directory")
+
     def __init__(self):
         self.hash = ''
         self.beatmapFile = ''
-
-        self.lastPlayed = datetime.datetime(1, 1, 1)
+        self.lastEdit = _TIMESTAMP_MIN
+        self.lastPlayed = _TIMESTAMP_MIN
         self.directory = ''
 
     @classmethod
-    def fromOsuDb(cls, osudb):
+    def fromBuffer(cls, buf, pos, version):
+        """Parses the beatmap entry at pos, returns it and the offset of the next entry."""
         self = cls()
-        _ = osudb.readOsuString()  # artistA
-        _ = osudb.readOsuString()  # artistU
-        _ = osudb.readOsuString()  # titleA
-        _ = osudb.readOsuString()  # titleU
-        _ = osudb.readOsuString()  # creator
-        _ = osudb.readOsuString()  # diffName
-        _ = osudb.readOsuString()  # audioFile
-        self.hash = osudb.readOsuString()
-        self.beatmapFile = osudb.readOsuString()
-
-        _ = osudb.readByte()  # state
-        _ = osudb.readShort()  # circles
-        _ = osudb.readShort()  # sliders
-        _ = osudb.readShort()  # spinners
-        self.lastEdit = osudb.readOsuTimestamp()  # lastEdit
-        _ = osudb.readFloat()  # AR
-        _ = osudb.readFloat()  # CS
-        _ = osudb.readFloat()  # HP
-        _ = osudb.readFloat()  # OD
-        _ = osudb.readDouble()  # SV
-        for _ in range(4):
-            for _ in range(osudb.readInt()):
-                _ = int(osudb.readOsuAny())  # mods
-                _ = float(osudb.readOsuAny())  # sr
-        _ = osudb.readInt()  # drainTime
-        _ = osudb.readInt()  # totalTime
-        _ = osudb.readInt()  # previewTime
-
-        for _ in range(osudb.readInt()):
-            _ = TimingPoint.fromOsuDb(osudb)
-
-        _ = osudb.readInt()  # mapID
-        _ = osudb.readInt()  # mapsetID
-        _ = osudb.readInt()  # threadID
-        for _ in range(4):
-            _ = osudb.readByte()
-        _ = osudb.readShort()  # offset
-        _ = osudb.readFloat()  # stackLeniency
-        _ = osudb.readByte()  # mode
-        _ = osudb.readOsuString()  # source
-        _ = osudb.readOsuString()  # tags
-        _ = osudb.readShort()  # onlineOffset
-        _ = osudb.readOsuString()  # onlineTitle
-        _ = osudb.readByte()  # isNew
-        self.lastPlayed = osudb.readOsuTimestamp()
-        _ = osudb.readByte()  # osz2
-        self.directory = osudb.readOsuString()
-        _ = osudb.readOsuTimestamp()  # lastSync
-        _ = osudb.readByte()  # disableHitSounds
-        _ = osudb.readByte()  # disableSkin
-        _ = osudb.readByte()  # disableSb
-        _ = osudb.readByte()  # disableVideo
-        _ = osudb.readShort()  # bgDim
-
-        _ = osudb.readInt()
-
-        return self
+        hash_pos, last_edit_pos, _, _, last_played_pos, directory_pos, end = _walk_beatmap(buf, pos, version)
+        self.hash, pos = read_string(buf, hash_pos)
+        self.beatmapFile, _ = read_string(buf, pos)
+        self.lastEdit = ticks_to_datetime(_LONG.unpack_from(buf, last_edit_pos)[0])
+        self.lastPlayed = ticks_to_datetime(_LONG.unpack_from(buf, last_played_pos)[0])
+        self.directory, _ = read_string(buf, directory_pos)
+        return self, end
+
+
+def _walk_beatmap(buf, pos, version):
+    """
+    Skips over the beatmap entry at pos.
+
+    Returns the offsets of the hash, lastEdit, drainTime, mapID, lastPlayed and directory fields and of the next entry.
+    """
+    entry_end = None
+    if version < VERSION_NO_ENTRY_SIZE:
+        entry_end = pos + 4 + _INT.unpack_from(buf, pos)[0]
+        pos += 4
+    for _ in range(7):  # artistA, artistU, titleA, titleU, creator, diffName, audioFile
+        pos = skip_string(buf, pos)
+    hash_pos = pos
+    pos = skip_string(buf, pos)  # hash
+    pos = skip_string(buf, pos)  # beatmapFile
+
+    last_edit_pos = pos + _STATE_TO_LAST_EDIT
+    pos = last_edit_pos + 8
+    if version < VERSION_FLOAT_DIFFICULTY:
+        pos += 4 + 8  # AR, CS, HP, OD as bytes, SV
+    else:
+        pos += _DIFFICULTY
+        sr_size = 1 + 4 + 1 + (4 if version >= VERSION_FLOAT_STAR_RATING else 8)
+        for _ in range(4):  # std, taiko, ctb, mania
+            pos += 4 + _INT.unpack_from(buf, pos)[0] * sr_size
+    times_pos = pos
+    pos += _TIMES
+    pos += 4 + _INT.unpack_from(buf, pos)[0] * _TIMING_POINT
+    ids_pos = pos
+    pos += _IDS_TO_MODE
+    pos = skip_string(buf, pos)  # source
+    pos = skip_string(buf, pos)  # tags
+    pos += 2  # onlineOffset
+    pos = skip_string(buf, pos)  # onlineTitle
+    pos += 1  # isNew
+    last_played_pos = pos
+    pos += 8 + 1  # lastPlayed, osz2
+    directory_pos = pos
+    pos = skip_string(buf, pos)
+    pos += _AFTER_DIRECTORY
+    if version < VERSION_FLOAT_DIFFICULTY:
+        pos += 2  # unknown short
+
+    return (hash_pos, last_edit_pos, times_pos, ids_pos, last_played_pos, directory_pos,
+            entry_end if entry_end is not None else pos)
+
+
+# decoders of the optional columns, each gets the buffer, the offsets _walk_beatmap returned and the version
+
+def _status(buf, entry, version):
+    return buf[entry[1] - _STATE_TO_LAST_EDIT]
+
+
+def _mode(buf, entry, version):
+    return buf[entry[3] + _IDS_TO_MODE - 1]
+
+
+def _difficulty(index):
+    def decode(buf, entry, version):
+        if version < VERSION_FLOAT_DIFFICULTY:
+            return float(buf[entry[1] + 8 + index])
+        return _FLOAT.unpack_from(buf, entry[1] + 8 + 4 * index)[0]
+    return decode
+
+
+def _stars(buf, entry, version):
+    """No-mod star rating in the beatmap's own mode, 0 if osu! hasn't calculated it (or the version has none)."""
+    mode = _mode(buf, entry, version)
+    if version < VERSION_FLOAT_DIFFICULTY or mode > 3:
+        return 0.0
+    single = version >= VERSION_FLOAT_STAR_RATING
+    pair_size = 1 + 4 + 1 + (4 if single else 8)  # 0x08, mods, 0x0c or 0x0d, rating
+    pos = entry[1] + 8 + _DIFFICULTY
+    for _ in range(mode):  # std, taiko, ctb, mania
+        pos += 4 + _INT.unpack_from(buf, pos)[0] * pair_size
+    count = _INT.unpack_from(buf, pos)[0]
+    pos += 4
+    for _ in range(count):
+        if not _INT.unpack_from(buf, pos + 1)[0]:
+            return (_FLOAT if single else _DOUBLE).unpack_from(buf, pos + 6)[0]
+        pos += pair_size
+    return 0.0
+
+
+def _int_at(field, offset):
+    def decode(buf, entry, version):
+        return _INT.unpack_from(buf, entry[field] + offset)[0]
+    return decode
+
+
+def _last_edit(buf, entry, version):
+    return _LONG.unpack_from(buf, entry[1])[0]
+
+
+# name -> (array typecode, decoder) of the columns a query can ask SmallOsuDb.load_columns for, see query.py
+BEATMAP_FIELDS = {
+    "status": ("B", _status),  # ranked status
+    "mode": ("B", _mode),
+    "stars": ("f", _stars),
+    "ar": ("f", _difficulty(0)),
+    "cs": ("f", _difficulty(1)),
+    "hp": ("f", _difficulty(2)),
+    "od": ("f", _difficulty(3)),
+    "drain_time": ("i", _int_at(2, 0)),  # seconds
+    "total_time": ("i", _int_at(2, 4)),  # milliseconds
+    "beatmap_id": ("i", _int_at(3, 0)),
+    "mapset_id": ("i", _int_at(3, 4)),
+    "last_edit": ("q", _last_edit),  # ticks
+}
@@ -0,0 +1,166 @@
+"""
+Watches an osu! folder for changes to its databases and to Songs, see Engine.refresh.
+
+On Linux this uses inotify through ctypes, so nothing gets read until something changes. Everywhere
+else (or if inotify isn't available) the databases and Songs are polled with a stat every few seconds.
+Changes are collected until things are quiet for a moment, osu! writes a database in several steps
+and a Cleanup moves thousands of folders.
+"""
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import threading
+
+from utils import file_signature
+
+DATABASES = ["osu!.db", "collection.db", "scores.db"]
+POLL_INTERVAL = 2.0
+SETTLE_TIME = 0.5  # seconds without a new change before on_change gets called
+
+# from <sys/inotify.h>
+_IN_CLOSE_WRITE = 0x008
+_IN_MOVED_FROM = 0x040
+_IN_MOVED_TO = 0x080
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_MOVE_SELF = 0x800
+_IN_ONLYDIR = 0x01000000
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len, followed by len bytes of name
+
+
+class _Inotify:
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def watch(self, path, mask):
+        wd = self.add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read(self, timeout):
+        """Returns (wd, mask, name) of every event that arrives within timeout seconds."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos < len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, pos)
+            pos += _EVENT.size
+            events.append((wd, mask, os.fsdecode(data[pos:pos + length].rstrip(b"\0"))))
+            pos += length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Watcher:
+    """
+    Calls on_change(changed) from its own thread whenever databases or Songs of the osu! folder in path change.
+
+    changed is a set of the database file names that changed, plus "Songs" if folders got added to or
+    removed from it. Changes inside a beatmap folder don't count, they don't change what a scan finds.
+    """
+
+    def __init__(self, path, on_change, interval=POLL_INTERVAL, settle=SETTLE_TIME):
+        self.path = str(path)
+        self.on_change = on_change
+        self.interval = interval
+        self.settle = settle
+        self.stopped = threading.Event()
+        self.thread = None
+        self.mode = None  # "inotify" or "polling" once started
+
+    def start(self):
+        inotify = None
+        try:
+            inotify = self._start_inotify()
+        except (OSError, AttributeError):  # not Linux, or out of watches
+            pass
+        self.mode = "polling" if inotify is None else "inotify"
+        if inotify is None:
+            self.thread = threading.Thread(target=self._poll, name="osu!cleaner watcher", daemon=True)
+        else:
+            self.thread = threading.Thread(target=self._listen, args=(inotify,), name="osu!cleaner watcher",
+                                           daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def _start_inotify(self):
+        inotify = _Inotify()
+        try:
+            # osu! replaces its databases by renaming a new file over them
+            self.root_wd = inotify.watch(self.path, _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+                                         | _IN_ONLYDIR)
+            self.songs_wd = inotify.watch(os.path.join(self.path, "Songs"), _IN_CREATE | _IN_DELETE | _IN_MOVED_FROM
+                                          | _IN_MOVED_TO | _IN_DELETE_SELF | _IN_MOVE_SELF | _IN_ONLYDIR)
+        except OSError:
+            inotify.close()
+            raise
+        return inotify
+
+    def _listen(self, inotify):
+        changed = set()
+        try:
+            while not self.stopped.is_set():
+                events = inotify.read(self.settle)  # short, so stop() doesn't have to wait long
+                for wd, mask, name in events:
+                    if wd == -1:  # the kernel's queue overflowed, anything could have changed
+                        changed.update([*DATABASES, "Songs"])
+                    elif wd == self.songs_wd:
+                        changed.add("Songs")
+                    elif wd == self.root_wd and (name in DATABASES or name == "Songs"):
+                        changed.add(name)
+                if changed and not events:
+                    self._report(changed)
+                    changed = set()
+        finally:
+            inotify.close()
+
+    def _snapshot(self):
+        state = {}
+        for name in [*DATABASES, "Songs"]:
+            try:
+                # a folder's mtime changes whenever an entry is added to or removed from it
+                state[name] = file_signature(os.path.join(self.path, name))
+            except OSError:
+                state[name] = None
+        return state
+
+    def _poll(self):
+        last = self._snapshot()
+        pending = set()
+        while not self.stopped.wait(self.settle if pending else self.interval):
+            current = self._snapshot()
+            changed = {name for name in current if current[name] != last[name]}
+            last = current
+            if changed:
+                pending |= changed
+            elif pending:
+                self._report(pending)
+                pending = set()
+
+    def _report(self, changed):
+        if not self.stopped.is_set():
+            self.on_change(set(changed))
@@ -0,0 +1,95 @@
+"""
+Database loaders that run in worker processes during Logic.analyze.
+
+Nothing in here may import Qt: workers are spawned fresh and only get the shared progress array,
+every loader writes its (done, total) pair into its own slot of it.
+"""
+import multiprocessing
+import os
+
+import tracing
+from store import BeatmapColumns, BeatmapStore
+from utils import BEATMAP_FIELDS, SmallOsuDb, SmallCollectionDb, SmallScoresDb
+
+MAX_PROCESSES = os.cpu_count() or 1
+SHARD_MIN_BEATMAPS = 20000  # below this, splitting osu!.db costs more than it saves
+
+_progress = None
+
+
+def init_worker(progress, trace_events=None):
+    global _progress
+    _progress = progress
+    if trace_events is not None:
+        tracing.forward_to(trace_events, f"osu!cleaner worker {os.getpid()}")
+
+
+class SlotProgress:
+    """Same start/update interface as progress.Reporter, but writes into the shared progress array."""
+
+    def __init__(self, slot):
+        self.index = 2 * slot
+
+    def start(self, total):
+        _progress[self.index] = 0
+        _progress[self.index + 1] = int(total)
+
+    def update(self, done):
+        _progress[self.index] = int(done)
+
+
+@tracing.traced("parse collection.db")
+def load_collections(slot, filename):
+    progress = SlotProgress(slot)
+    cl_db = SmallCollectionDb(filename)
+    progress.start(cl_db.collectionCount)
+    names = []
+    membership = {}  # hash -> bitmask of the collections it is in
+    for i, (name, hashes) in enumerate(cl_db):
+        bit = 1 << i
+        for h in hashes:
+            membership[h] = membership.get(h, 0) | bit
+        names.append(name)
+        progress.update(i + 1)
+    tracing.count("bytes read", len(cl_db.inFile))
+    tracing.count("collections decoded", len(names))
+    cl_db.inFile.close()
+    return names, membership
+
+
+@tracing.traced("parse scores.db")
+def load_scores(slot, filename):
+    sc_db = SmallScoresDb(filename, SlotProgress(slot))
+    tracing.count("bytes read", len(sc_db.inFile))
+    tracing.count("scores decoded", sum(sc_db.scoreCounts.values()))
+    tracing.count("bad score records", len(sc_db.errors))
+    sc_db.inFile.close()
+    return sc_db.scoreCounts, sc_db.errors
+
+
+@tracing.traced("parse osu!.db")
+def load_beatmaps(slot, filename, offset=None, count=None, fields=()):
+    """Decodes a range of osu!.db, fields names the optional columns to decode on top, see utils.BEATMAP_FIELDS."""
+    columns = BeatmapColumns({name: BEATMAP_FIELDS[name][0] for name in fields})
+    osu_db = SmallOsuDb(filename, SlotProgress(slot), offset, count, columns)
+    tracing.count("bytes read", osu_db.end - (offset if offset is not None else osu_db.firstBeatmap))
+    tracing.count("beatmaps decoded", len(columns))
+    tracing.count("optional fields decoded", len(columns) * len(fields))
+    osu_db.inFile.close()
+    with tracing.span("sort osu!.db shard", beatmaps=len(columns)):
+        columns.sort()  # here the sort runs in parallel for every shard, merge_beatmaps only has to interleave them
+    return columns
+
+
+@tracing.traced("merge osu!.db shards")
+def merge_beatmaps(parts, stopped=None):
+    """Combines the results of load_beatmaps shards into one BeatmapStore, parts have to be in file order."""
+    return BeatmapStore.merge(parts, stopped)
+
+
+def create_pool(processes, slots):
+    """Returns a process pool and the progress array its workers report into."""
+    context = multiprocessing.get_context("spawn")  # forking a process that runs Qt threads isn't safe
+    progress = context.Array("q", 2 * slots, lock=False)
+    pool = context.Pool(processes, initializer=init_worker, initargs=(progress, tracing.collector(context)))
+    return pool, progress